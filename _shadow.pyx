@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+/***************************************************************************
+ FLYGHT7 -  TOFPA
+                                 A QGIS plugin
+ Takeoff and Final Approach Analysis Tool
+
+ Optional compiled shadow kernel. Build it in the plugin directory with
+ `cythonize -i _shadow.pyx`; tofpa_analysis uses it when it is importable
+ and falls back to Numba or NumPy otherwise.
+
+ /***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import numpy as np
+
+from libc.math cimport cos, hypot, M_PI
+
+
+def shadow_pairs(double[::1] xs, double[::1] ys, double[::1] hs,
+                 double tx, double ty, double tz, double tol_deg):
+    """
+    Pairwise shadow test of obstacles seen from the takeoff point (tx, ty, tz).
+
+    Same contract as tofpa_analysis.shadow_pairs: returns, for each
+    obstacle, the index of the first shadowing obstacle or -1.
+    """
+    cdef Py_ssize_t n = xs.shape[0]
+    cdef Py_ssize_t i, j
+    cdef double cos_tol = cos(tol_deg * M_PI / 180.0)
+    cdef double dx, dy
+
+    distance_arr = np.empty(n, dtype=np.float64)
+    ux_arr = np.zeros(n, dtype=np.float64)
+    uy_arr = np.zeros(n, dtype=np.float64)
+    shadowed_by_arr = np.full(n, -1, dtype=np.int64)
+    cdef double[::1] distance = distance_arr
+    cdef double[::1] ux = ux_arr
+    cdef double[::1] uy = uy_arr
+    cdef long long[::1] shadowed_by = shadowed_by_arr
+
+    with nogil:
+        for i in range(n):
+            dx = xs[i] - tx
+            dy = ys[i] - ty
+            distance[i] = hypot(dx, dy)
+            if distance[i] > 0.0:
+                ux[i] = dx / distance[i]
+                uy[i] = dy / distance[i]
+
+        for i in range(n):
+            # Ascending j, so the first hit is the lowest shadowing index
+            for j in range(n):
+                # Shadowing obstacle must be closer (never true for j == i) and higher
+                if distance[j] >= distance[i] or hs[j] <= hs[i] or distance[j] <= 0.0:
+                    continue
+                # Within the angular tolerance (shadow cone)
+                if ux[i] * ux[j] + uy[i] * uy[j] < cos_tol:
+                    continue
+                # Higher elevation angle, compared as cross-multiplied ratios
+                if (hs[j] - tz) * distance[i] > (hs[i] - tz) * distance[j]:
+                    shadowed_by[i] = j
+                    break
+
+    return shadowed_by_arr
@@ -20,14 +20,28 @@ from qgis.PyQt.QtWidgets import QFileDialog, QAction
 from qgis.core import (QgsProject, QgsVectorLayer, QgsFeature, QgsGeometry, 
                       QgsPoint, QgsField, QgsPolygon, QgsLineString, Qgis, 
                       QgsFillSymbol, QgsLineSymbol, QgsMarkerSymbol, QgsVectorFileWriter, QgsCoordinateTransform,
-                      QgsCoordinateReferenceSystem, QgsWkbTypes)
+                      QgsCoordinateReferenceSystem, QgsWkbTypes, QgsVertexId, QgsFeatureRequest,
+                      QgsVectorLayerFeatureSource, QgsFeatureSource, QgsFeatureSink, QgsTask, QgsApplication,
+                      QgsCsException)
+from osgeo import gdal
 
+import itertools
+import logging
 import os.path
+import xml.etree.ElementTree as ET
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from math import *
 
+import numpy as np
+
 # Import the dockwidget with error handling
 try:
     from .tofpa_dockwidget import TofpaDockWidget
+    from .tofpa_analysis import (OBSTACLE_DTYPE, circle_template, gml_pos_list,
+                                 point_z_wkb, points_in_rings_threaded,
+                                 polygon_wkb, project_points, shadow_pairs)
 except ImportError as e:
     print(f"Import error: {e}")
     # Fallback import
@@ -36,6 +50,150 @@ except ImportError as e:
     plugin_dir = os.path.dirname(__file__)
     sys.path.insert(0, plugin_dir)
     from tofpa_dockwidget import TofpaDockWidget
+    from tofpa_analysis import (OBSTACLE_DTYPE, circle_template, gml_pos_list,
+                                point_z_wkb, points_in_rings_threaded,
+                                polygon_wkb, project_points, shadow_pairs)
+
+logger = logging.getLogger(__name__)
+
+# KML entries below this size (bytes) are stored in the KMZ without compression
+KMZ_STORE_MAX_SIZE = 32768
+
+# Attribute schemas of the memory layers, shared by every calculation;
+# addAttributes copies the fields
+REFERENCE_LINE_FIELDS = [
+    QgsField('id', QVariant.Int),
+    QgsField('txt-label', QVariant.String)
+]
+TOFPA_SURFACE_FIELDS = [
+    QgsField('ID', QVariant.String),
+    QgsField('SurfaceName', QVariant.String)
+]
+OBSTACLE_FIELDS = [
+    QgsField('id', QVariant.Int),
+    QgsField('height', QVariant.Double),
+    QgsField('buffer_m', QVariant.Double),
+    QgsField('status', QVariant.String),
+    QgsField('intersection', QVariant.String),
+    QgsField('shadow_status', QVariant.String),  # Shadow analysis result
+    QgsField('shadowed_by', QVariant.String)     # Which obstacle causes the shadow
+]
+OBSTACLE_BUFFER_FIELDS = [
+    QgsField('obstacle_id', QVariant.Int),
+    QgsField('buffer_m', QVariant.Double),
+    QgsField('status', QVariant.String)
+]
+
+# TOFPA surface and reference line symbology
+REFERENCE_LINE_STYLE = {
+    'color': '255,0,0,255',  # Red color
+    'width': '0.25'
+}
+TOFPA_SURFACE_STYLE = {
+    'color': '128,128,128,102',  # Grey with 40% opacity
+    'outline_color': '0,0,0,255',
+    'outline_width': '0.5'
+}
+
+# AIXM 5.1.1 message root attributes (namespaces and schema)
+AIXM_MESSAGE_ATTRIBUTES = (
+    ("xmlns:aixm", "http://www.aixm.aero/schema/5.1.1"),
+    ("xmlns:gml", "http://www.opengis.net/gml/3.2"),
+    ("xmlns:xlink", "http://www.w3.org/1999/xlink"),
+    ("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance"),
+    ("xsi:schemaLocation", "http://www.aixm.aero/schema/5.1.1 http://www.aixm.aero/schema/5.1.1/AIXM_BasicMessage.xsd"),
+)
+# Write buffer (bytes) of the streamed AIXM file
+AIXM_WRITE_BUFFER_SIZE = 1 << 20
+
+# Static markup of a TOFPA surface NavigationArea feature member, written around
+# the per-feature ids, begin time and geometry
+AIXM_NAV_AREA_OPEN = (
+    '  <gml:featureMember>\n'
+    '    <aixm:NavigationArea gml:id="tofpa_surface_'
+)
+AIXM_NAV_AREA_TIME_SLICE_OPEN = (
+    '">\n'
+    '      <aixm:timeSlice>\n'
+    '        <aixm:NavigationAreaTimeSlice gml:id="ts_'
+)
+AIXM_NAV_AREA_TIME_PERIOD_OPEN = (
+    '">\n'
+    '          <gml:validTime>\n'
+    '            <gml:TimePeriod gml:id="tp_'
+)
+AIXM_NAV_AREA_BEGIN_OPEN = (
+    '">\n'
+    '              <gml:beginPosition>'
+)
+AIXM_NAV_AREA_BEGIN_CLOSE = (
+    '</gml:beginPosition>\n'
+    '              <gml:endPosition indeterminatePosition="unknown" />\n'
+    '            </gml:TimePeriod>\n'
+    '          </gml:validTime>\n'
+    '          <aixm:interpretation>BASELINE</aixm:interpretation>\n'
+    '          <aixm:designator>TOFPA_AOC_TypeA</aixm:designator>\n'
+    '          <aixm:type>TAKEOFF_CLIMB_SURFACE</aixm:type>\n'
+)
+AIXM_NAV_AREA_CLOSE = (
+    '        </aixm:NavigationAreaTimeSlice>\n'
+    '      </aixm:timeSlice>\n'
+    '    </aixm:NavigationArea>\n'
+    '  </gml:featureMember>\n'
+)
+
+# Obstacles layer symbology, in the order the layers are added to the map
+CRITICAL_OBSTACLE_STYLE = {
+    'color': '255,0,0,255',  # Red
+    'size': '4',
+    'outline_color': '0,0,0,255'
+}
+SAFE_OBSTACLE_STYLE = {
+    'color': '0,255,0,255',  # Green
+    'size': '3',
+    'outline_color': '0,0,0,255'
+}
+BUFFER_ZONE_STYLE = {
+    'color': '255,255,0,100',  # Yellow with transparency
+    'outline_color': '255,165,0,255',  # Orange outline
+    'outline_width': '0.3'
+}
+SHADOWED_OBSTACLE_STYLE = {
+    'color': '255,165,0,255',  # Orange
+    'size': '4',
+    'outline_color': '0,0,0,255',
+    'outline_width': '0.5'
+}
+VISIBLE_OBSTACLE_STYLE = {
+    'color': '139,0,0,255',  # Dark red
+    'size': '5',
+    'outline_color': '0,0,0,255',
+    'outline_width': '0.5'
+}
+OBSTACLE_LAYER_STYLES = (
+    ('critical_layer', QgsMarkerSymbol, CRITICAL_OBSTACLE_STYLE),
+    ('safe_layer', QgsMarkerSymbol, SAFE_OBSTACLE_STYLE),
+    ('buffer_layer', QgsFillSymbol, BUFFER_ZONE_STYLE),
+    ('shadowed_layer', QgsMarkerSymbol, SHADOWED_OBSTACLE_STYLE),
+    ('visible_layer', QgsMarkerSymbol, VISIBLE_OBSTACLE_STYLE),
+)
+
+
+@contextmanager
+def _suspend_layer_updates(layers_info):
+    """Block the signals of the obstacles memory layers while they are being filled"""
+    layers = [layer for layer in layers_info.values() if layer is not None]
+    for layer in layers:
+        layer.blockSignals(True)
+    try:
+        yield
+    finally:
+        for layer in layers:
+            layer.blockSignals(False)
+            # One extent update and repaint for everything added while blocked
+            layer.updateExtents()
+            layer.triggerRepaint()
+
 
 class TOFPA:
     """QGIS Plugin Implementation."""
@@ -47,6 +205,14 @@ class TOFPA:
         self.menu = self.tr(u'&TOFPA')
         self.first_start = True
         self.panel = None
+        # TOFPA surface geometries cached for the duration of an obstacles analysis
+        self._surface_geoms = None
+        self._surface_union = None
+        self._takeoff_xyz = None
+        # Transforms to WGS84 keyed by source CRS authid, reused across exports
+        self._wgs84_transforms = {}
+        # Running AIXM export tasks, each referenced until it finishes
+        self._aixm_export_tasks = set()
 
     def tr(self, message):
         """Get the translation for a string using Qt translation API."""
@@ -97,8 +263,9 @@ class TOFPA:
         for action in self.actions:
             self.iface.removePluginMenu(self.tr(u'&TOFPA'), action)
             self.iface.removeToolBarIcon(action)
-        # Remove the panel if it's open
+        # Remove the panel if it's open; closing it releases its project signal connections
         if self.panel:
+            self.panel.close()
             self.iface.removeDockWidget(self.panel)
             self.panel = None
 
@@ -146,7 +313,8 @@ class TOFPA:
             params['obstacle_buffer'],
             params['min_obstacle_height'],
             params['enable_shadow_analysis'],
-            params['shadow_tolerance']
+            params['shadow_tolerance'],
+            params.get('draw_reference_line', True)
         )
         if success:
             self.iface.messageBar().pushMessage("TOFPA:", "TakeOff Climb Surface Calculation Finished", level=Qgis.Success)
@@ -157,10 +325,11 @@ class TOFPA:
         Returns the feature if successful, None if error (with error message displayed).
         """
         if use_selected_feature:
-            selected_features = layer.selectedFeatures()
-            if len(selected_features) == 1:
-                return selected_features[0]
-            elif len(selected_features) > 1:
+            # Count the selection before fetching it, so a large selection is never read
+            selected_count = layer.selectedFeatureCount()
+            if selected_count == 1:
+                return next(layer.getSelectedFeatures())
+            elif selected_count > 1:
                 self.iface.messageBar().pushMessage(
                     "Error", 
                     f"Please select only one {feature_type} in layer '{layer.name()}'.", 
@@ -175,17 +344,21 @@ class TOFPA:
                 )
                 return None
         else:
-            all_features = list(layer.getFeatures())
-            if len(all_features) == 1:
-                return all_features[0]
-            elif len(all_features) > 1:
+            # Only read as far as the second feature to tell 0, 1 and many apart;
+            # the limit lets the provider stop there too
+            features = layer.getFeatures(QgsFeatureRequest().setLimit(2))
+            first_feature = next(features, None)
+            second_feature = next(features, None)
+            if first_feature is not None and second_feature is None:
+                return first_feature
+            elif second_feature is not None:
                 self.iface.messageBar().pushMessage(
                     "Error", 
                     f"Layer '{layer.name()}' has more than one {feature_type}. Please select one and check 'Use selected features only'.", 
                     level=Qgis.Critical
                 )
                 return None
-            elif len(all_features) == 0:
+            else:
                 self.iface.messageBar().pushMessage(
                     "Error", 
                     f"No {feature_type}s found in layer '{layer.name()}'.", 
@@ -196,34 +369,45 @@ class TOFPA:
     def create_tofpa_surface(self, width_tofpa, max_width_tofpa, cwy_length, z0, ze, s, 
                             runway_layer_id, threshold_layer_id, use_selected_feature, export_kmz, export_aixm,
                             include_obstacles, obstacles_layer_id, obstacle_height_field, obstacle_buffer, min_obstacle_height,
-                            enable_shadow_analysis, shadow_tolerance):
+                            enable_shadow_analysis, shadow_tolerance, draw_reference_line=True):
         """Create the TOFPA surface with the given parameters - ORIGINAL LOGIC + OBSTACLES + SHADOW ANALYSIS"""
         
         map_srid = self.iface.mapCanvas().mapSettings().destinationCrs().authid()
         
-        # Get runway layer by ID
-        runway_layer = QgsProject.instance().mapLayer(runway_layer_id)
+        project = QgsProject.instance()
+        
+        # Resolve the input layers by ID once for the whole run
+        runway_layer = project.mapLayer(runway_layer_id)
+        threshold_layer = project.mapLayer(threshold_layer_id)
+        obstacles_layer = None
+        if include_obstacles and obstacles_layer_id:
+            obstacles_layer = project.mapLayer(obstacles_layer_id)
+        
         if not runway_layer:
             self.iface.messageBar().pushMessage("Error", "Selected runway layer not found!", level=Qgis.Critical)
             return False
+        if not threshold_layer:
+            self.iface.messageBar().pushMessage("Error", "Selected threshold layer not found!", level=Qgis.Critical)
+            return False
         
         # Get single runway feature using robust selection logic
         runway_feature = self.get_single_feature(runway_layer, use_selected_feature, "runway feature")
         if not runway_feature:
             return False
         
-        # Get runway geometry (from original script)
+        # Get runway geometry (from original script); read it and its vertices once
         rwy_geom = runway_feature.geometry()
-        rwy_length = rwy_geom.length()
-        rwy_slope = (z0-ze)/rwy_length if rwy_length > 0 else 0
-        print(f"Runway length: {rwy_length}")
-        
-        # Get the azimuth of the line (from original script)
-        geom = runway_feature.geometry().asPolyline()
+        geom = rwy_geom.asPolyline()
         if len(geom) < 2:
             self.iface.messageBar().pushMessage("Error", "Runway geometry must have at least 2 points!", level=Qgis.Critical)
             return False
-            
+        
+        rwy_length = rwy_geom.length()
+        rwy_slope = (z0-ze)/rwy_length if rwy_length > 0 else 0
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Runway length: %s", rwy_length)
+        
         # Calculate azimuth based on runway direction (simplified logic)
         # s=0 means takeoff from start to end, s=-1 means takeoff from end to start
         if s == 0:
@@ -239,17 +423,12 @@ class TOFPA:
         azimuth = start_point.azimuth(end_point)  # azimuth in takeoff direction
         bazimuth = azimuth + 180  # opposite direction (backward from azimuth)
         
-        print(f"Start point: {start_point.x()}, {start_point.y()}")
-        print(f"End point: {end_point.x()}, {end_point.y()}")
-        print(f"Takeoff azimuth: {azimuth}")
-        print(f"Backward azimuth: {bazimuth}")
-        print(f"s parameter: {s}")
-        
-        # Get the threshold point from selected layer
-        threshold_layer = QgsProject.instance().mapLayer(threshold_layer_id)
-        if not threshold_layer:
-            self.iface.messageBar().pushMessage("Error", "Selected threshold layer not found!", level=Qgis.Critical)
-            return False
+        if debug:
+            logger.debug("Start point: %s, %s", start_point.x(), start_point.y())
+            logger.debug("End point: %s, %s", end_point.x(), end_point.y())
+            logger.debug("Takeoff azimuth: %s", azimuth)
+            logger.debug("Backward azimuth: %s", bazimuth)
+            logger.debug("s parameter: %s", s)
         
         # Get single threshold feature using robust selection logic
         threshold_feature = self.get_single_feature(threshold_layer, use_selected_feature, "threshold feature")
@@ -260,9 +439,10 @@ class TOFPA:
         new_geom = QgsPoint(threshold_feature.geometry().asPoint())
         new_geom.addZValue(z0)
         
-        print(f"Threshold point: {new_geom.x()}, {new_geom.y()}, {new_geom.z()}")
-        print(f"Parameters - Width: {width_tofpa}, Max Width: {max_width_tofpa}")
-        print(f"CWY Length: {cwy_length}, Z0: {z0}, ZE: {ze}")
+        if debug:
+            logger.debug("Threshold point: %s, %s, %s", new_geom.x(), new_geom.y(), new_geom.z())
+            logger.debug("Parameters - Width: %s, Max Width: %s", width_tofpa, max_width_tofpa)
+            logger.debug("CWY Length: %s, Z0: %s, ZE: %s", cwy_length, z0, ze)
         
         list_pts = []
         # Origin (from original script)
@@ -273,77 +453,64 @@ class TOFPA:
             dD = 0  # there is a condition to use the runway strip to analyze
         else:
             dD = cwy_length
-        print(f"dD (distance for surface start): {dD}")
-        
-        # Calculate all points for the TOFPA surface using PROJECT method (ORIGINAL LOGIC)
-        # First project backward from threshold to get the start point (if CWY length > 0)
-        pt_01D = new_geom.project(dD, azimuth)  # Project from threshold by CWY length in the direction of the flight
-        pt_01D.setZ(ze)
-        print(f"pt_01D (start point): {pt_01D.x()}, {pt_01D.y()}, {pt_01D.z()}")
-        pt_01DL = pt_01D.project(width_tofpa/2, azimuth+90)  # Use azimuth for perpendicular direction
-        pt_01DR = pt_01D.project(width_tofpa/2, azimuth-90)  # Use azimuth for perpendicular direction
-        
-        # Distance to reach maximum width (from original script - ALL use azimuth for forward projection)
-        pt_02D = pt_01D.project(((max_width_tofpa/2-width_tofpa/2)/0.125), azimuth)
-        pt_02D.setZ(ze+((max_width_tofpa/2-width_tofpa/2)/0.125)*0.012)
-        pt_02DL = pt_02D.project(max_width_tofpa/2, azimuth+90)  # Use azimuth for perpendicular
-        pt_02DR = pt_02D.project(max_width_tofpa/2, azimuth-90)  # Use azimuth for perpendicular
-        
-        # Distance to end of TakeOff Climb Surface (from original script - ALL use azimuth for forward projection)
-        pt_03D = pt_01D.project(10000, azimuth)
-        pt_03D.setZ(ze+10000*0.012)
-        pt_03DL = pt_03D.project(max_width_tofpa/2, azimuth+90)  # Use azimuth for perpendicular
-        pt_03DR = pt_03D.project(max_width_tofpa/2, azimuth-90)  # Use azimuth for perpendicular
+        if debug:
+            logger.debug("dD (distance for surface start): %s", dD)
+        
+        # Calculate all points for the TOFPA surface (ORIGINAL LOGIC) as coordinate arrays
+        # in a single planar projection: distance along the takeoff azimuth from the
+        # surface start and lateral offset towards azimuth+90 (left) or azimuth-90 (right)
+        d_max_width = (max_width_tofpa/2-width_tofpa/2)/0.125  # Distance to reach maximum width
+        d_end = 10000  # Distance to end of TakeOff Climb Surface
+        along = np.array([0, 0, 0,
+                          d_max_width, d_max_width, d_max_width,
+                          d_end, d_end, d_end,
+                          0, 0], dtype=np.float64)
+        offsets = np.array([0, width_tofpa/2, -width_tofpa/2,
+                            0, max_width_tofpa/2, -max_width_tofpa/2,
+                            0, max_width_tofpa/2, -max_width_tofpa/2,
+                            3000, -3000], dtype=np.float64)  # Reference line: 3000m each side of the start point
+        # The surface climbs at 1.2% from the start elevation (reference line stays level)
+        zs = ze + along*0.012
+        xs, ys = project_points(new_geom.x(), new_geom.y(), azimuth, dD + along, offsets)
+        (pt_01D, pt_01DL, pt_01DR,
+         pt_02D, pt_02DL, pt_02DR,
+         pt_03D, pt_03DL, pt_03DR,
+         ref_line_left, ref_line_right) = [
+            QgsPoint(x, y, z) for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist())
+        ]
         
         list_pts.extend((pt_0D, pt_01D, pt_01DL, pt_01DR, pt_02D, pt_02DL, pt_02DR, pt_03D, pt_03DL, pt_03DR))
         
-        # Create reference line perpendicular to trajectory at start point (3000m each side)
-        # The start point depends on whether CWY exists or not
-        reference_start_point = pt_01D  # This is the calculated start point (considers CWY)
-        
-        # Create points 3000m on each side perpendicular to the azimuth
-        ref_line_left = reference_start_point.project(3000, azimuth+90)  # 3000m to the left
-        ref_line_right = reference_start_point.project(3000, azimuth-90)  # 3000m to the right
-        
-        # Set same elevation as start point
-        ref_line_left.setZ(reference_start_point.z())
-        ref_line_right.setZ(reference_start_point.z())
-        
-        print(f"Reference line left point: {ref_line_left.x()}, {ref_line_left.y()}, {ref_line_left.z()}")
-        print(f"Reference line right point: {ref_line_right.x()}, {ref_line_right.y()}, {ref_line_right.z()}")
-        
-        # Create reference line memory layer
-        ref_layer = QgsVectorLayer(f"LineStringZ?crs={map_srid}", "reference_line", "memory")
-        ref_id_field = QgsField('id', QVariant.Int)
-        ref_label_field = QgsField('txt-label', QVariant.String)
-        ref_layer.dataProvider().addAttributes([ref_id_field, ref_label_field])
-        ref_layer.updateFields()
-        
-        # Create the reference line feature
-        ref_feature = QgsFeature()
-        ref_line_geom = QgsLineString([ref_line_left, ref_line_right])
-        ref_feature.setGeometry(QgsGeometry(ref_line_geom))
-        ref_feature.setAttributes([1, 'tofpa reference line'])
-        ref_layer.dataProvider().addFeatures([ref_feature])
-        
-        # Style the reference line (red color, width 0.25)
-        ref_symbol = QgsLineSymbol.createSimple({
-            'color': '255,0,0,255',  # Red color
-            'width': '0.25'
-        })
-        ref_layer.renderer().setSymbol(ref_symbol)
-        ref_layer.triggerRepaint()
-        
-        # Add reference line layer to map
-        QgsProject.instance().addMapLayers([ref_layer])
+        if debug:
+            logger.debug("pt_01D (start point): %s, %s, %s", pt_01D.x(), pt_01D.y(), pt_01D.z())
+            logger.debug("Reference line left point: %s, %s, %s", ref_line_left.x(), ref_line_left.y(), ref_line_left.z())
+            logger.debug("Reference line right point: %s, %s, %s", ref_line_right.x(), ref_line_right.y(), ref_line_right.z())
+        
+        # Create reference line memory layer, unless the caller does not want it
+        ref_layer = None
+        if draw_reference_line:
+            ref_layer = QgsVectorLayer(f"LineStringZ?crs={map_srid}", "reference_line", "memory")
+            ref_layer.dataProvider().addAttributes(REFERENCE_LINE_FIELDS)
+            ref_layer.updateFields()
+        
+            # Create the reference line feature
+            ref_feature = QgsFeature()
+            ref_line_geom = QgsLineString([ref_line_left, ref_line_right])
+            ref_feature.setGeometry(QgsGeometry(ref_line_geom))
+            ref_feature.setAttributes([1, 'tofpa reference line'])
+            ref_layer.dataProvider().addFeatures([ref_feature])
+        
+            # Style the reference line (red color, width 0.25)
+            ref_layer.renderer().setSymbol(QgsLineSymbol.createSimple(REFERENCE_LINE_STYLE))
+            ref_layer.triggerRepaint()
+        
+            # Add reference line layer to map
+            project.addMapLayers([ref_layer])
         
         # Creation of the Take Off Climb Surfaces (from original script)
         # Create memory layer
         v_layer = QgsVectorLayer(f"PolygonZ?crs={map_srid}", "RWY_TOFPA_AOC_TypeA", "memory")
-        id_field = QgsField('ID', QVariant.String)
-        name_field = QgsField('SurfaceName', QVariant.String)
-        v_layer.dataProvider().addAttributes([id_field])
-        v_layer.dataProvider().addAttributes([name_field])
+        v_layer.dataProvider().addAttributes(TOFPA_SURFACE_FIELDS)
         v_layer.updateFields()
         
         # Take Off Climb Surface Creation (from original script)
@@ -355,15 +522,10 @@ class TOFPA:
         pr.addFeatures([seg])
         
         # Load PolygonZ Layer to map canvas (from original script)
-        QgsProject.instance().addMapLayers([v_layer])
+        project.addMapLayers([v_layer])
         
         # Change style of layer (from original script but using modern syntax)
-        symbol = QgsFillSymbol.createSimple({
-            'color': '128,128,128,102',  # Grey with 40% opacity
-            'outline_color': '0,0,0,255',
-            'outline_width': '0.5'
-        })
-        v_layer.renderer().setSymbol(symbol)
+        v_layer.renderer().setSymbol(QgsFillSymbol.createSimple(TOFPA_SURFACE_STYLE))
         v_layer.triggerRepaint()
         
         # Process survey obstacles if requested
@@ -371,7 +533,7 @@ class TOFPA:
         if include_obstacles and obstacles_layer_id:
             try:
                 obstacles_info = self.process_survey_obstacles(
-                    obstacles_layer_id, 
+                    obstacles_layer, 
                     obstacle_height_field, 
                     obstacle_buffer, 
                     min_obstacle_height,
@@ -388,8 +550,8 @@ class TOFPA:
                     
                     if enable_shadow_analysis and 'shadow_results' in obstacles_info:
                         shadow_results = obstacles_info['shadow_results']
-                        shadowed_count = len(shadow_results.get('shadowed_obstacles', []))
-                        visible_count = len([obs for obs in shadow_results.get('visible_obstacles', []) if obs.get('is_critical', False)])
+                        shadowed_count = int(np.count_nonzero(shadow_results['shadowed_by'] >= 0))
+                        visible_count = obstacles_info['critical_obstacles'] - shadowed_count
                         message += f", {shadowed_count} shadowed, {visible_count} visible"
                     
                     # Display obstacles analysis results
@@ -406,7 +568,7 @@ class TOFPA:
                 )
         
         # Prepare layers for export (include obstacles if they exist)
-        layers_to_export = [v_layer, ref_layer] + obstacles_layers
+        layers_to_export = [v_layer] + ([ref_layer] if ref_layer is not None else []) + obstacles_layers
         
         # Export to KMZ if requested
         if export_kmz:
@@ -416,21 +578,18 @@ class TOFPA:
         if export_aixm:
             self.export_to_aixm(layers_to_export)
         
-        # Zoom to layer (from original script)
-        v_layer.selectAll()
+        # Zoom to layer (from original script); the layer is in the canvas CRS, so its
+        # extent is used directly instead of selecting all features and zooming to them
         canvas = self.iface.mapCanvas()
-        canvas.zoomToSelected(v_layer)
-        v_layer.removeSelection()
+        canvas.zoomToFeatureExtent(v_layer.extent())
         
-        # Get canvas scale (from original script)
-        sc = canvas.scale()
-        if sc < 20000:
-            sc = 20000
-        canvas.zoomScale(sc)
+        # Keep the canvas scale at 1:20000 or smaller (from original script)
+        if canvas.scale() < 20000:
+            canvas.zoomScale(20000)
         
         return True
 
-    def process_survey_obstacles(self, obstacles_layer_id, height_field, buffer_distance, 
+    def process_survey_obstacles(self, obstacles_layer, height_field, buffer_distance, 
                                 min_height, tofpa_surface_layer, use_selected_feature,
                                 enable_shadow_analysis=False, shadow_tolerance=5.0):
         """
@@ -439,64 +598,56 @@ class TOFPA:
         This creates a separate model that works with survey obstacles while
         a process is derived to run both analyses simultaneously to produce a final output.
         """
-        # Get obstacles layer
-        obstacles_layer = QgsProject.instance().mapLayer(obstacles_layer_id)
+        # The obstacles layer is resolved by the caller; None when its ID was not found
         if not obstacles_layer:
             raise Exception("Selected obstacles layer not found!")
         
-        # Validate height field
-        field_names = [field.name() for field in obstacles_layer.fields()]
-        if height_field and height_field not in field_names:
+        # Validate height field and resolve it to a field index once (-1 when not used)
+        height_index = obstacles_layer.fields().indexOf(height_field) if height_field else -1
+        if height_field and height_index < 0:
             raise Exception(f"Height field '{height_field}' not found in obstacles layer!")
         
-        # Get features to process
+        # Only the height attribute is read from the obstacles
+        request = QgsFeatureRequest()
+        if height_index >= 0:
+            request.setSubsetOfAttributes([height_index])
+        else:
+            request.setNoAttributes()
+        
+        # Get features to process; they are streamed into the analysis
         if use_selected_feature:
-            features = obstacles_layer.selectedFeatures()
-            if not features:
+            feature_count = obstacles_layer.selectedFeatureCount()
+            if feature_count == 0:
                 raise Exception("No obstacles selected in layer. Please select obstacles or uncheck 'Use selected features only'.")
+            features = obstacles_layer.getSelectedFeatures(request)
         else:
-            features = list(obstacles_layer.getFeatures())
-        
-        if not features:
-            raise Exception("No obstacles found in layer.")
+            feature_count = obstacles_layer.featureCount()
+            if feature_count == 0:
+                raise Exception("No obstacles found in layer.")
+            features = obstacles_layer.getFeatures(request)
         
         # Create layers for obstacles analysis
         layers_info = self._create_obstacles_layers(obstacles_layer.crs())
         
-        # Process each obstacle and collect obstacle data
-        critical_obstacles = 0
-        total_obstacles = 0
-        obstacles_data = []  # Store all obstacle information for shadow analysis
-        
-        for feature in features:
-            try:
-                obstacle_info = self._analyze_single_obstacle(
-                    feature, height_field, buffer_distance, min_height, 
-                    tofpa_surface_layer, layers_info
-                )
-                total_obstacles += 1
-                if obstacle_info['is_critical']:
-                    critical_obstacles += 1
-                
-                # Store obstacle data for shadow analysis
-                obstacles_data.append({
-                    'feature': feature,
-                    'obstacle_info': obstacle_info,
-                    'point': obstacle_info['obstacle_point'],
-                    'height': obstacle_info['height'],
-                    'is_critical': obstacle_info['is_critical']
-                })
-                
-            except Exception as e:
-                print(f"Warning: Failed to process obstacle feature {feature.id()}: {str(e)}")
-                continue
+        # Read the TOFPA surface once; it does not change during the analysis
+        self._prepare_surface(tofpa_surface_layer)
         
-        # Perform shadow analysis on critical obstacles if enabled
-        shadow_results = {'shadowed_obstacles': [], 'visible_obstacles': obstacles_data}
-        if enable_shadow_analysis:
-            shadow_results = self._perform_shadow_analysis(obstacles_data, tofpa_surface_layer, shadow_tolerance)
-            # Update layers with shadow analysis results
-            self._apply_shadow_results(layers_info, shadow_results)
+        # Layer signals stay blocked until every feature has been added
+        with _suspend_layer_updates(layers_info):
+            # Analyze all obstacles in one batch; results are kept in a record array
+            obstacles = self._analyze_obstacles(
+                features, feature_count, obstacles_layer.geometryType(), height_index,
+                buffer_distance, min_height, layers_info
+            )
+            total_obstacles = len(obstacles)
+            critical_obstacles = int(np.count_nonzero(obstacles['is_critical']))
+            
+            # Perform shadow analysis on critical obstacles if enabled (and there are any)
+            shadow_results = {'shadowed_by': np.full(total_obstacles, -1, dtype=np.int64)}
+            if enable_shadow_analysis and critical_obstacles > 0:
+                shadow_results = self._perform_shadow_analysis(obstacles, shadow_tolerance)
+                # Update layers with shadow analysis results
+                self._apply_shadow_results(layers_info, obstacles, shadow_results)
         
         # Add layers to map and style them
         self._finalize_obstacles_layers(layers_info)
@@ -513,41 +664,27 @@ class TOFPA:
         """Create memory layers for obstacles analysis including shadow analysis layers"""
         # Critical obstacles layer (red)
         critical_layer = QgsVectorLayer(f"PointZ?crs={crs.authid()}", "Critical_Obstacles", "memory")
-        critical_fields = [
-            QgsField('id', QVariant.Int),
-            QgsField('height', QVariant.Double),
-            QgsField('buffer_m', QVariant.Double),
-            QgsField('status', QVariant.String),
-            QgsField('intersection', QVariant.String),
-            QgsField('shadow_status', QVariant.String),  # New field for shadow analysis
-            QgsField('shadowed_by', QVariant.String)     # Which obstacle causes the shadow
-        ]
-        critical_layer.dataProvider().addAttributes(critical_fields)
+        critical_layer.dataProvider().addAttributes(OBSTACLE_FIELDS)
         critical_layer.updateFields()
         
         # Safe obstacles layer (green)
         safe_layer = QgsVectorLayer(f"PointZ?crs={crs.authid()}", "Safe_Obstacles", "memory")
-        safe_layer.dataProvider().addAttributes(critical_fields)
+        safe_layer.dataProvider().addAttributes(OBSTACLE_FIELDS)
         safe_layer.updateFields()
         
         # Shadowed obstacles layer (orange/purple)
         shadowed_layer = QgsVectorLayer(f"PointZ?crs={crs.authid()}", "Shadowed_Obstacles", "memory")
-        shadowed_layer.dataProvider().addAttributes(critical_fields)
+        shadowed_layer.dataProvider().addAttributes(OBSTACLE_FIELDS)
         shadowed_layer.updateFields()
         
         # Visible (non-shadowed) critical obstacles layer (dark red)
         visible_layer = QgsVectorLayer(f"PointZ?crs={crs.authid()}", "Visible_Critical_Obstacles", "memory")
-        visible_layer.dataProvider().addAttributes(critical_fields)
+        visible_layer.dataProvider().addAttributes(OBSTACLE_FIELDS)
         visible_layer.updateFields()
         
         # Buffer zones layer (yellow)
         buffer_layer = QgsVectorLayer(f"PolygonZ?crs={crs.authid()}", "Obstacle_Buffers", "memory")
-        buffer_fields = [
-            QgsField('obstacle_id', QVariant.Int),
-            QgsField('buffer_m', QVariant.Double),
-            QgsField('status', QVariant.String)
-        ]
-        buffer_layer.dataProvider().addAttributes(buffer_fields)
+        buffer_layer.dataProvider().addAttributes(OBSTACLE_BUFFER_FIELDS)
         buffer_layer.updateFields()
         
         return {
@@ -558,51 +695,148 @@ class TOFPA:
             'buffer_layer': buffer_layer
         }
 
-    def _analyze_single_obstacle(self, feature, height_field, buffer_distance, min_height, 
-                                tofpa_surface_layer, layers_info):
-        """Analyze a single obstacle against TOFPA surface"""
+    def _prepare_surface(self, tofpa_surface_layer):
+        """Cache the TOFPA surface geometries and their union for the obstacles analysis"""
+        request = QgsFeatureRequest().setNoAttributes()
+        self._surface_geoms = [QgsGeometry(f.geometry()) for f in tofpa_surface_layer.getFeatures(request)]
+        self._surface_union = QgsGeometry.unaryUnion(self._surface_geoms)
+        # The takeoff point only depends on the surface, so resolve it (and its Z) once
+        self._takeoff_xyz = self._get_takeoff_reference_point(self._surface_geoms)
+
+    def _analyze_obstacles(self, features, feature_count, geometry_type, height_index,
+                           buffer_distance, min_height, layers_info):
+        """
+        Analyze all obstacles against TOFPA surface in a single batch.
+        
+        Returns the processed obstacles as a NumPy array of OBSTACLE_DTYPE
+        records, one per valid feature. The records are filled in a buffer
+        preallocated from feature_count, which providers may only estimate
+        (or report as -1), so the buffer grows when it runs out of rows.
+        """
+        # The layer has a single geometry type, so pick the location extractor once
+        if geometry_type == QgsWkbTypes.PolygonGeometry:
+            # Use centroid for polygons
+            extract_point = lambda geom: geom.centroid().asPoint()
+        else:
+            # Use point directly
+            extract_point = lambda geom: geom.asPoint()
+        
+        obstacles = np.empty(max(feature_count, 0), dtype=OBSTACLE_DTYPE)
+        count = 0
+        for feature in features:
+            try:
+                location = self._get_obstacle_location(feature, extract_point, height_index, min_height)
+            except Exception as e:
+                logger.warning("Failed to process obstacle feature %s: %s", feature.id(), e)
+                continue
+            if location is None:
+                logger.warning("Skipping obstacle feature %s: invalid geometry", feature.id())
+                continue
+            x, y, obstacle_height = location
+            if count == len(obstacles):
+                grown = np.empty(max(2 * count, 1024), dtype=OBSTACLE_DTYPE)
+                grown[:count] = obstacles
+                obstacles = grown
+            obstacles[count] = (feature.id(), x, y, obstacle_height, False)
+            count += 1
+        # Invalid features leave unused rows at the end
+        obstacles = obstacles[:count]
+        # Raise surveyed heights to the minimum height in one pass
+        np.maximum(obstacles['height'], min_height, out=obstacles['height'])
+        
+        # Test every obstacle against the surface in one vectorized pass
+        obstacles['is_critical'] = self._critical_obstacle_mask(obstacles['x'], obstacles['y'], buffer_distance)
+        
+        # The buffer radius is the same for every obstacle, so build the circle once
+        buffer_template = circle_template(buffer_distance, 16) if buffer_distance > 0 else None
+        
+        # Collect output features and add them with a single call per layer
+        pending = {'critical_layer': [], 'safe_layer': [], 'buffer_layer': []}
+        build_features = self._build_obstacle_features
+        for fid, x, y, obstacle_height, is_critical in obstacles.tolist():
+            build_features(fid, x, y, obstacle_height, is_critical,
+                           buffer_distance, buffer_template, pending)
+        self._flush_features(layers_info, pending)
+        
+        return obstacles
+
+    def _get_obstacle_location(self, feature, extract_point, height_index, min_height):
+        """
+        Get the (x, y, height) of a single obstacle feature, or None if it has no geometry.
+        
+        The surveyed height is returned as is; the caller clamps it to min_height.
+        """
         # Get obstacle geometry and height
         geom = feature.geometry()
         if not geom or geom.isEmpty():
-            raise Exception("Invalid geometry")
+            return None
         
         # Get height from field or use minimum height
         obstacle_height = min_height
-        if height_field:
-            height_value = feature.attribute(height_field)
+        if height_index >= 0:
+            height_value = feature.attribute(height_index)
             if height_value is not None and isinstance(height_value, (int, float)):
-                obstacle_height = max(float(height_value), min_height)
+                obstacle_height = float(height_value)
         
-        # Create point geometry with height
-        if geom.type() == QgsWkbTypes.PolygonGeometry:
-            # Use centroid for polygons
-            centroid = geom.centroid().asPoint()
-            obstacle_point = QgsPoint(centroid.x(), centroid.y(), obstacle_height)
-        else:
-            # Use point directly
-            point = geom.asPoint()
-            obstacle_point = QgsPoint(point.x(), point.y(), obstacle_height)
+        # Get obstacle location
+        point = extract_point(geom)
         
-        # Create buffer around obstacle
-        buffer_geom = QgsGeometry.fromPointXY(QgsPoint(obstacle_point.x(), obstacle_point.y())).buffer(buffer_distance, 16)
+        return point.x(), point.y(), obstacle_height
+
+    def _critical_obstacle_mask(self, xs, ys, buffer_distance):
+        """
+        Flag the obstacles whose buffer intersects the TOFPA surface.
         
-        # Check intersection with TOFPA surface
-        is_critical = False
-        intersection_type = "None"
+        A circular buffer intersects the surface exactly when its centre lies
+        within the surface expanded by the buffer distance, so the surface is
+        buffered once and all obstacle points are tested in a single pass.
+        A zero buffer is an empty geometry that intersects nothing, so no
+        obstacle is critical then.
+        """
+        surface = self._surface_union
+        if buffer_distance <= 0 or not surface or surface.isEmpty():
+            return np.zeros(len(xs), dtype=bool)
         
-        for tofpa_feature in tofpa_surface_layer.getFeatures():
-            tofpa_geom = tofpa_feature.geometry()
-            if buffer_geom.intersects(tofpa_geom):
-                is_critical = True
-                intersection_type = "Buffer intersects TOFPA surface"
-                break
+        expanded_surface = surface.buffer(buffer_distance, 16)
+        if expanded_surface.isMultipart():
+            polygons = expanded_surface.asMultiPolygon()
+        else:
+            polygons = [expanded_surface.asPolygon()]
+        
+        is_critical = np.zeros(len(xs), dtype=bool)
+        for polygon in polygons:
+            rings = [
+                np.array([(vertex.x(), vertex.y()) for vertex in ring], dtype=np.float64)
+                for ring in polygon
+            ]
+            # Only points inside the part's bounding box need the full ring test
+            (xmin, ymin), (xmax, ymax) = rings[0].min(axis=0), rings[0].max(axis=0)
+            candidates = np.flatnonzero((xs >= xmin) & (xs <= xmax) & (ys >= ymin) & (ys <= ymax))
+            if candidates.size:
+                # Parts of the union are disjoint, so each point is inside at most one
+                is_critical[candidates] |= points_in_rings_threaded(xs[candidates], ys[candidates], rings)
+        return is_critical
+
+    def _build_obstacle_features(self, fid, x, y, obstacle_height, is_critical,
+                                 buffer_distance, buffer_template, pending):
+        """Build the analyzed obstacle and its buffer features and queue them in pending"""
+        # Create buffer around obstacle by translating the precomputed circle;
+        # geometries are built from WKB bytes instead of per-vertex QgsPointXY
+        buffer_geom = QgsGeometry()
+        if buffer_template is not None:
+            dx, dy = buffer_template
+            buffer_geom.fromWkb(polygon_wkb(dx + x, dy + y))
+        
+        intersection_type = "Buffer intersects TOFPA surface" if is_critical else "None"
         
         # Add to appropriate layer
+        obstacle_geom = QgsGeometry()
+        obstacle_geom.fromWkb(point_z_wkb(x, y, obstacle_height))
         obstacle_feature = QgsFeature()
-        obstacle_feature.setGeometry(QgsGeometry(obstacle_point))
+        obstacle_feature.setGeometry(obstacle_geom)
         # Update obstacle feature attributes to include shadow fields (initially empty)
         obstacle_feature.setAttributes([
-            int(feature.id()),
+            fid,
             obstacle_height,
             buffer_distance,
             "CRITICAL" if is_critical else "SAFE",
@@ -615,27 +849,28 @@ class TOFPA:
         buffer_feature = QgsFeature()
         buffer_feature.setGeometry(buffer_geom)
         buffer_feature.setAttributes([
-            int(feature.id()),
+            fid,
             buffer_distance,
             "CRITICAL" if is_critical else "SAFE"
         ])
         
-        # Add to appropriate layers
+        # Queue for the appropriate layers
         if is_critical:
-            layers_info['critical_layer'].dataProvider().addFeatures([obstacle_feature])
+            pending['critical_layer'].append(obstacle_feature)
         else:
-            layers_info['safe_layer'].dataProvider().addFeatures([obstacle_feature])
-        
-        layers_info['buffer_layer'].dataProvider().addFeatures([buffer_feature])
+            pending['safe_layer'].append(obstacle_feature)
         
-        return {
-            'is_critical': is_critical,
-            'height': obstacle_height,
-            'intersection_type': intersection_type,
-            'obstacle_point': obstacle_point  # Add obstacle point for shadow analysis
-        }
+        pending['buffer_layer'].append(buffer_feature)
+
+    def _flush_features(self, layers_info, pending):
+        """Add queued features to their layers with one provider call per layer"""
+        # The added features are not used afterwards, so the provider does not
+        # need to write the assigned ids back to them
+        for layer_key, features in pending.items():
+            if features:
+                layers_info[layer_key].dataProvider().addFeatures(features, QgsFeatureSink.FastInsert)
 
-    def _perform_shadow_analysis(self, obstacles_data, tofpa_surface_layer, shadow_tolerance=5.0):
+    def _perform_shadow_analysis(self, obstacles, shadow_tolerance=5.0):
         """
         Perform shadow analysis to determine which critical obstacles are shadowed by others.
         
@@ -644,276 +879,140 @@ class TOFPA:
         2. For each critical obstacle, check if any other obstacle closer to takeoff point
            and higher creates a shadow (blocks line of sight)
         3. Calculate line of sight angles and determine shadowing relationships
-        """
-        # Get takeoff reference point from TOFPA surface (use the starting point)
-        takeoff_point = self._get_takeoff_reference_point(tofpa_surface_layer)
-        if not takeoff_point:
-            return {'shadowed_obstacles': [], 'visible_obstacles': obstacles_data}
-        
-        # Filter only critical obstacles for shadow analysis
-        critical_obstacles = [obs for obs in obstacles_data if obs['is_critical']]
         
-        shadowed_obstacles = []
-        visible_obstacles = []
-        
-        for obstacle in critical_obstacles:
-            is_shadowed, shadowing_obstacle = self._is_obstacle_shadowed(
-                obstacle, critical_obstacles, takeoff_point, shadow_tolerance
-            )
-            
-            if is_shadowed:
-                obstacle['shadow_status'] = 'SHADOWED'
-                obstacle['shadowed_by'] = f"Obstacle ID {shadowing_obstacle['feature'].id()}"
-                shadowed_obstacles.append(obstacle)
-            else:
-                obstacle['shadow_status'] = 'VISIBLE'
-                obstacle['shadowed_by'] = ''
-                visible_obstacles.append(obstacle)
+        The pairwise test runs in tofpa_analysis.shadow_pairs: the Cython
+        kernel when it has been built, JIT-compiled with Numba when it is
+        installed and vectorized with NumPy otherwise.
+        Returns 'shadowed_by': for every obstacle the index of the obstacle
+        shadowing it, or -1 when it is not shadowed.
+        """
+        shadowed_by = np.full(len(obstacles), -1, dtype=np.int64)
         
-        # Include non-critical obstacles as visible
-        non_critical_obstacles = [obs for obs in obstacles_data if not obs['is_critical']]
-        for obstacle in non_critical_obstacles:
-            obstacle['shadow_status'] = 'NOT_APPLICABLE'
-            obstacle['shadowed_by'] = ''
+        # Get takeoff reference point from TOFPA surface (use the starting point)
+        if self._takeoff_xyz is None:
+            return {'shadowed_by': shadowed_by}
+        takeoff_x, takeoff_y, takeoff_z = self._takeoff_xyz
+        
+        # Only critical obstacles take part in the shadow analysis
+        critical_idx = np.flatnonzero(obstacles['is_critical'])
+        critical_shadowed_by = shadow_pairs(
+            obstacles['x'][critical_idx], obstacles['y'][critical_idx], obstacles['height'][critical_idx],
+            takeoff_x, takeoff_y, takeoff_z, float(shadow_tolerance)
+        )
         
-        visible_obstacles.extend(non_critical_obstacles)
+        # Map indices within the critical subset back to obstacle indices
+        hit = critical_shadowed_by >= 0
+        shadowed_by[critical_idx[hit]] = critical_idx[critical_shadowed_by[hit]]
         
         return {
-            'shadowed_obstacles': shadowed_obstacles,
-            'visible_obstacles': visible_obstacles,
-            'takeoff_point': takeoff_point
+            'shadowed_by': shadowed_by,
+            'takeoff_point': QgsPoint(takeoff_x, takeoff_y, takeoff_z)
         }
 
-    def _get_takeoff_reference_point(self, tofpa_surface_layer):
-        """Get the takeoff reference point from TOFPA surface layer"""
+    def _get_takeoff_reference_point(self, surface_geoms):
+        """Get the takeoff reference point (x, y, z) from the TOFPA surface geometries"""
         try:
-            # Get the first feature from TOFPA surface
-            for feature in tofpa_surface_layer.getFeatures():
-                geom = feature.geometry()
+            # Get the first geometry from TOFPA surface
+            for geom in surface_geoms:
                 if geom.type() == QgsWkbTypes.PolygonGeometry:
                     # Get the centroid of the starting edge of the TOFPA surface
                     # The TOFPA surface is typically oriented with takeoff point at one end
-                    vertices = geom.asPolygon()[0]  # Get exterior ring
-                    if len(vertices) >= 4:
-                        # Use the average of the first two vertices (should be the starting edge)
-                        start_point1 = vertices[0]
-                        start_point2 = vertices[-2]  # Second to last (before closing vertex)
+                    # Read the exterior ring vertices in place instead of copying the ring
+                    surface = geom.constGet()
+                    vertex_count = surface.vertexCount(0, 0)
+                    if vertex_count >= 6:
+                        # The ring is built as [03DR, 03DL, 02DL, 01DL, 01DR, 02DR, closing],
+                        # so vertices 3 and 4 are the starting edge (pt_01DL and pt_01DR)
+                        start_point1 = surface.vertexAt(QgsVertexId(0, 0, 3))
+                        start_point2 = surface.vertexAt(QgsVertexId(0, 0, 4))
                         takeoff_x = (start_point1.x() + start_point2.x()) / 2
                         takeoff_y = (start_point1.y() + start_point2.y()) / 2
-                        takeoff_z = (start_point1.z() + start_point2.z()) / 2 if start_point1.is3D() else 0
-                        return QgsPoint(takeoff_x, takeoff_y, takeoff_z)
+                        takeoff_z = (start_point1.z() + start_point2.z()) / 2 if surface.is3D() else 0.0
+                        return takeoff_x, takeoff_y, takeoff_z
             return None
         except Exception as e:
-            print(f"Error getting takeoff reference point: {e}")
+            logger.error("Error getting takeoff reference point: %s", e)
             return None
 
-    def _is_obstacle_shadowed(self, target_obstacle, all_obstacles, takeoff_point, shadow_tolerance=5.0):
-        """
-        Check if target obstacle is shadowed by any other obstacle.
-        
-        An obstacle is shadowed if:
-        1. Another obstacle is closer to the takeoff point
-        2. The other obstacle is higher
-        3. The other obstacle is within the line of sight cone (angular tolerance)
-        """
-        target_point = target_obstacle['point']
-        target_height = target_obstacle['height']
-        
-        # Calculate distance and angle from takeoff to target obstacle
-        target_distance = takeoff_point.distance(target_point)
-        target_angle = self._calculate_bearing(takeoff_point, target_point)
-        
-        for other_obstacle in all_obstacles:
-            if other_obstacle['feature'].id() == target_obstacle['feature'].id():
-                continue  # Skip self
-            
-            other_point = other_obstacle['point']
-            other_height = other_obstacle['height']
-            
-            # Check if other obstacle is closer to takeoff point
-            other_distance = takeoff_point.distance(other_point)
-            if other_distance >= target_distance:
-                continue  # Other obstacle is further, can't shadow
-            
-            # Check if other obstacle is higher
-            if other_height <= target_height:
-                continue  # Other obstacle is lower, can't shadow
-            
-            # Check if other obstacle is within angular tolerance (shadow cone)
-            other_angle = self._calculate_bearing(takeoff_point, other_point)
-            angular_difference = abs(target_angle - other_angle)
-            
-            # Handle angle wraparound (359° vs 1°)
-            if angular_difference > 180:
-                angular_difference = 360 - angular_difference
-            
-            # Use configurable tolerance for shadowing
-            if angular_difference <= shadow_tolerance:
-                # Check elevation angle to determine if shadow is significant
-                if self._check_elevation_shadow(takeoff_point, target_point, target_height, 
-                                               other_point, other_height):
-                    return True, other_obstacle
-        
-        return False, None
-
-    def _calculate_bearing(self, from_point, to_point):
-        """Calculate bearing (azimuth) from one point to another in degrees"""
-        try:
-            return from_point.azimuth(to_point)
-        except:
-            # Fallback calculation if azimuth method fails
-            dx = to_point.x() - from_point.x()
-            dy = to_point.y() - from_point.y()
-            return (atan2(dx, dy) * 180 / pi) % 360
-
-    def _check_elevation_shadow(self, takeoff_point, target_point, target_height, 
-                               shadow_point, shadow_height):
-        """
-        Check if the shadowing obstacle actually blocks the line of sight to target obstacle
-        based on elevation angles.
-        """
-        try:
-            # Calculate horizontal distances
-            target_distance = takeoff_point.distance(target_point)
-            shadow_distance = takeoff_point.distance(shadow_point)
-            
-            if target_distance <= 0 or shadow_distance <= 0:
-                return False
-            
-            # Calculate elevation angles from takeoff point
-            takeoff_height = takeoff_point.z() if takeoff_point.is3D() else 0
-            
-            target_elevation_angle = atan((target_height - takeoff_height) / target_distance) * 180 / pi
-            shadow_elevation_angle = atan((shadow_height - takeoff_height) / shadow_distance) * 180 / pi
-            
-            # Target is shadowed if shadow obstacle has higher elevation angle
-            return shadow_elevation_angle > target_elevation_angle
-            
-        except Exception as e:
-            print(f"Error in elevation shadow check: {e}")
-            return False
-
-    def _apply_shadow_results(self, layers_info, shadow_results):
+    def _apply_shadow_results(self, layers_info, obstacles, shadow_results):
         """Apply shadow analysis results to create shadowed and visible obstacle layers"""
         try:
-            shadowed_obstacles = shadow_results.get('shadowed_obstacles', [])
-            visible_obstacles = shadow_results.get('visible_obstacles', [])
+            ids = obstacles['id'].tolist()
+            xs = obstacles['x'].tolist()
+            ys = obstacles['y'].tolist()
+            heights = obstacles['height'].tolist()
+            shadowed_by = shadow_results['shadowed_by'].tolist()
             
-            # Create features for shadowed obstacles
+            # Only critical obstacles go to the shadow layers
             shadowed_features = []
-            for obstacle in shadowed_obstacles:
-                if obstacle['is_critical']:  # Only process critical obstacles for shadow layers
-                    feature = QgsFeature()
-                    feature.setGeometry(QgsGeometry(obstacle['point']))
-                    feature.setAttributes([
-                        int(obstacle['feature'].id()),
-                        obstacle['height'],
-                        10.0,  # default buffer
-                        "CRITICAL",
-                        obstacle['obstacle_info']['intersection_type'],
-                        obstacle['shadow_status'],
-                        obstacle['shadowed_by']
-                    ])
-                    shadowed_features.append(feature)
-            
-            # Create features for visible critical obstacles
             visible_features = []
-            for obstacle in visible_obstacles:
-                if obstacle['is_critical']:  # Only process critical obstacles for visible layers
-                    feature = QgsFeature()
-                    feature.setGeometry(QgsGeometry(obstacle['point']))
-                    feature.setAttributes([
-                        int(obstacle['feature'].id()),
-                        obstacle['height'],
-                        10.0,  # default buffer
-                        "CRITICAL",
-                        obstacle['obstacle_info']['intersection_type'],
-                        obstacle.get('shadow_status', 'VISIBLE'),
-                        obstacle.get('shadowed_by', '')
-                    ])
-                    visible_features.append(feature)
+            add_shadowed = shadowed_features.append
+            add_visible = visible_features.append
+            for i in np.flatnonzero(obstacles['is_critical']).tolist():
+                shadow_index = shadowed_by[i]
+                if shadow_index >= 0:
+                    shadow_status = 'SHADOWED'
+                    shadowed_by_text = f"Obstacle ID {ids[shadow_index]}"
+                else:
+                    shadow_status = 'VISIBLE'
+                    shadowed_by_text = ''
+                
+                geom = QgsGeometry()
+                geom.fromWkb(point_z_wkb(xs[i], ys[i], heights[i]))
+                feature = QgsFeature()
+                feature.setGeometry(geom)
+                feature.setAttributes([
+                    ids[i],
+                    heights[i],
+                    10.0,  # default buffer
+                    "CRITICAL",
+                    "Buffer intersects TOFPA surface",
+                    shadow_status,
+                    shadowed_by_text
+                ])
+                if shadow_index >= 0:
+                    add_shadowed(feature)
+                else:
+                    add_visible(feature)
             
             # Add features to respective layers
-            if shadowed_features:
-                layers_info['shadowed_layer'].dataProvider().addFeatures(shadowed_features)
-            if visible_features:
-                layers_info['visible_layer'].dataProvider().addFeatures(visible_features)
+            self._flush_features(layers_info, {
+                'shadowed_layer': shadowed_features,
+                'visible_layer': visible_features
+            })
                 
         except Exception as e:
-            print(f"Error applying shadow results: {e}")
+            logger.error("Error applying shadow results: %s", e)
 
     def _finalize_obstacles_layers(self, layers_info):
         """Add obstacles layers to map and apply styling"""
-        # Style critical obstacles (red)
-        critical_symbol = QgsMarkerSymbol.createSimple({
-            'color': '255,0,0,255',  # Red
-            'size': '4',
-            'outline_color': '0,0,0,255'
-        })
-        layers_info['critical_layer'].renderer().setSymbol(critical_symbol)
-        
-        # Style safe obstacles (green)
-        safe_symbol = QgsMarkerSymbol.createSimple({
-            'color': '0,255,0,255',  # Green
-            'size': '3',
-            'outline_color': '0,0,0,255'
-        })
-        layers_info['safe_layer'].renderer().setSymbol(safe_symbol)
-        
-        # Style shadowed obstacles (orange/purple)
-        if 'shadowed_layer' in layers_info and layers_info['shadowed_layer'].featureCount() > 0:
-            shadowed_symbol = QgsMarkerSymbol.createSimple({
-                'color': '255,165,0,255',  # Orange
-                'size': '4',
-                'outline_color': '0,0,0,255',
-                'outline_width': '0.5'
-            })
-            layers_info['shadowed_layer'].renderer().setSymbol(shadowed_symbol)
-        
-        # Style visible critical obstacles (dark red)
-        if 'visible_layer' in layers_info and layers_info['visible_layer'].featureCount() > 0:
-            visible_symbol = QgsMarkerSymbol.createSimple({
-                'color': '139,0,0,255',  # Dark red
-                'size': '5',
-                'outline_color': '0,0,0,255',
-                'outline_width': '0.5'
-            })
-            layers_info['visible_layer'].renderer().setSymbol(visible_symbol)
-        
-        # Style buffer zones (yellow with transparency)
-        buffer_symbol = QgsFillSymbol.createSimple({
-            'color': '255,255,0,100',  # Yellow with transparency
-            'outline_color': '255,165,0,255',  # Orange outline
-            'outline_width': '0.3'
-        })
-        layers_info['buffer_layer'].renderer().setSymbol(buffer_symbol)
-        
-        # Prepare layers list for map addition
-        layers_to_add = [
-            layers_info['critical_layer'],
-            layers_info['safe_layer'], 
-            layers_info['buffer_layer']
-        ]
-        
-        # Add shadow analysis layers if they have features
-        if 'shadowed_layer' in layers_info and layers_info['shadowed_layer'].featureCount() > 0:
-            layers_to_add.append(layers_info['shadowed_layer'])
-        if 'visible_layer' in layers_info and layers_info['visible_layer'].featureCount() > 0:
-            layers_to_add.append(layers_info['visible_layer'])
+        layers_to_add = []
+        for layer_key, symbol_class, style in OBSTACLE_LAYER_STYLES:
+            layer = layers_info.get(layer_key)
+            if layer is None:
+                continue
+            # Shadow analysis layers are only added (and styled) if they have features
+            if layer_key in ('shadowed_layer', 'visible_layer') and layer.featureCount() == 0:
+                continue
+            layer.renderer().setSymbol(symbol_class.createSimple(style))
+            layers_to_add.append(layer)
         
         # Add all layers to map
         QgsProject.instance().addMapLayers(layers_to_add)
 
     def export_to_kmz(self, layers):
         """Export layers to KMZ format for Google Earth with proper styling"""
-        # Handle both single layer and list of layers
-        if not isinstance(layers, list):
-            layers = [layers]
-        
-        # Check if any layer has features
-        has_features = any(layer.featureCount() > 0 for layer in layers)
-        if not has_features:
-            self.iface.messageBar().pushMessage(
+        push_message = self.iface.messageBar().pushMessage
+        # Handle both single layer and a list or tuple of layers
+        if not isinstance(layers, (list, tuple)):
+            layers = (layers,)
+        
+        # Check each layer for features once; hasFeatures avoids a full count on
+        # providers that scan the source to count, and layers that only maybe
+        # have features are left to the writer
+        has_features = [layer.hasFeatures() != QgsFeatureSource.NoFeaturesAvailable for layer in layers]
+        if not any(has_features):
+            push_message(
                 "Error", 
                 "No features to export in any layer", 
                 level=Qgis.Critical
@@ -921,17 +1020,15 @@ class TOFPA:
             return False
             
         # Ask user for save location
-        file_dialog = QFileDialog()
-        file_dialog.setDefaultSuffix('kmz')
-        file_path, _ = file_dialog.getSaveFileName(
-            None, 
+        file_path, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(), 
             "Save KMZ File", 
             "", 
             "KMZ Files (*.kmz)"
         )
         
         if not file_path:
-            self.iface.messageBar().pushMessage(
+            push_message(
                 "Info", 
                 "KMZ export cancelled by user", 
                 level=Qgis.Info
@@ -939,17 +1036,15 @@ class TOFPA:
             return False
         
         # Ensure file has .kmz extension
-        if not file_path.lower().endswith('.kmz'):
+        if file_path[-4:].lower() != '.kmz':
             file_path += '.kmz'
         
         # Convert KML to KMZ (zip multiple KML files)
-        import zipfile
+        transform_context = QgsProject.instance().transformContext()
         try:
             with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                temp_files = []
-                
-                for i, layer in enumerate(layers):
-                    if layer.featureCount() == 0:
+                for i, (layer, layer_has_features) in enumerate(zip(layers, has_features)):
+                    if not layer_has_features:
                         continue
                         
                     # Set up KML options with proper styling and absolute altitude
@@ -961,89 +1056,87 @@ class TOFPA:
                     options.datasourceOptions = ['ALTITUDE_MODE=absolute']
                     
                     # KML uses EPSG:4326 (WGS84)
-                    crs_4326 = QgsCoordinateReferenceSystem("EPSG:4326")
-                    options.ct = QgsCoordinateTransform(
-                        layer.crs(), 
-                        crs_4326, 
-                        QgsProject.instance()
-                    )
+                    options.ct = self._get_wgs84_transform(layer.crs())
                     
-                    # Write to temporary KML
-                    temp_kml = file_path.replace('.kmz', f'_{i}_{layer.name()}.kml')
-                    temp_files.append(temp_kml)
+                    # Write the KML to GDAL's in-memory filesystem instead of a temporary file
+                    kml_name = os.path.basename(file_path).replace('.kmz', f'_{i}_{layer.name()}.kml')
+                    temp_kml = f'/vsimem/{kml_name}'
                     
                     result = QgsVectorFileWriter.writeAsVectorFormatV2(
                         layer,
                         temp_kml,
-                        QgsProject.instance().transformContext(),
+                        transform_context,
                         options
                     )
                     
                     if result[0] != QgsVectorFileWriter.NoError:
-                        self.iface.messageBar().pushMessage(
+                        gdal.Unlink(temp_kml)
+                        push_message(
                             "Error", 
                             f"Failed to export layer {layer.name()} to KML: {result[1]}", 
                             level=Qgis.Critical
                         )
                         continue
                     
-                    # Add KML file to ZIP
-                    zipf.write(temp_kml, os.path.basename(temp_kml))
-                
-                # Remove temporary KML files
-                for temp_file in temp_files:
+                    # Add the in-memory KML to the ZIP and release it
+                    kml_file = gdal.VSIFOpenL(temp_kml, 'rb')
                     try:
-                        os.remove(temp_file)
-                    except PermissionError:
-                        self.iface.messageBar().pushMessage(
-                            "Warning", 
-                            f"Could not delete temporary KML file: {temp_file}", 
-                            level=Qgis.Warning
-                        )
+                        kml_data = gdal.VSIFReadL(1, gdal.VSIStatL(temp_kml).size, kml_file)
+                    finally:
+                        gdal.VSIFCloseL(kml_file)
+                        gdal.Unlink(temp_kml)
+                    compress_type = zipfile.ZIP_STORED if len(kml_data) <= KMZ_STORE_MAX_SIZE else zipfile.ZIP_DEFLATED
+                    zipf.writestr(kml_name, kml_data, compress_type=compress_type)
             
-            self.iface.messageBar().pushMessage(
+            push_message(
                 "Success", 
                 f"Exported {len(layers)} layers to KMZ: {file_path}", 
                 level=Qgis.Success
             )
             return True
             
-        except Exception as e:
-            self.iface.messageBar().pushMessage(
+        except (OSError, ValueError, zipfile.BadZipFile, QgsCsException) as e:
+            logger.error("Failed to create KMZ file: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            push_message(
                 "Error", 
                 f"Failed to create KMZ file: {str(e)}", 
                 level=Qgis.Critical
             )
             return False
+        except Exception:
+            logger.exception("Unexpected error while creating KMZ file %s", file_path)
+            raise
+
+    def _get_wgs84_transform(self, crs):
+        """Return the cached transform from crs to EPSG:4326, creating it on first use"""
+        transform = self._wgs84_transforms.get(crs.authid())
+        if transform is None:
+            transform = QgsCoordinateTransform(
+                crs,
+                QgsCoordinateReferenceSystem("EPSG:4326"),
+                QgsProject.instance()
+            )
+            self._wgs84_transforms[crs.authid()] = transform
+        return transform
 
     def export_to_aixm(self, layers):
         """Export layers to AIXM 5.1.1 format for aviation data exchange"""
-        # Handle both single layer and list of layers
-        if not isinstance(layers, list):
-            layers = [layers]
-        
-        # Check if any layer has features
-        has_features = any(layer.featureCount() > 0 for layer in layers)
-        if not has_features:
-            self.iface.messageBar().pushMessage(
-                "Error", 
-                "No features to export in any layer", 
-                level=Qgis.Critical
-            )
-            return False
-            
-        # Ask user for save location
-        file_dialog = QFileDialog()
-        file_dialog.setDefaultSuffix('xml')
-        file_path, _ = file_dialog.getSaveFileName(
-            None, 
+        push_message = self.iface.messageBar().pushMessage
+        # Handle both single layer and a list or tuple of layers
+        if not isinstance(layers, (list, tuple)):
+            layers = (layers,)
+        
+        # Ask user for save location; empty layers are detected while writing,
+        # so features are only read once
+        file_path, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(), 
             "Save AIXM File", 
             "", 
             "AIXM Files (*.xml)"
         )
         
         if not file_path:
-            self.iface.messageBar().pushMessage(
+            push_message(
                 "Info", 
                 "AIXM export cancelled by user", 
                 level=Qgis.Info
@@ -1051,114 +1144,175 @@ class TOFPA:
             return False
         
         # Ensure file has .xml extension
-        if not file_path.lower().endswith('.xml'):
+        if file_path[-4:].lower() != '.xml':
             file_path += '.xml'
         
-        try:
-            self._generate_aixm_file(layers, file_path)
-            
-            self.iface.messageBar().pushMessage(
-                "Success", 
-                f"Exported {len(layers)} layers to AIXM: {file_path}", 
-                level=Qgis.Success
-            )
-            return True
+        # Write next to the target and move it into place once complete, so a
+        # failed export never leaves a truncated file under the chosen name
+        part_path = file_path + '.part'
+        
+        def export_finished(exception, result=None):
+            self._aixm_export_tasks.discard(task)
+            # The task wrapper raises a plain exception when it is canceled
+            # before it starts, so a canceled task is reported as such
+            canceled = task.isCanceled() or (result is not None and result['canceled'])
+            if exception is None and not canceled and result['features_written']:
+                try:
+                    os.replace(part_path, file_path)
+                except OSError as e:
+                    # Exceptions raised here are swallowed by the task wrapper
+                    exception = e
+                else:
+                    push_message(
+                        "Success", 
+                        f"Exported {len(layers)} layers to AIXM: {file_path}", 
+                        level=Qgis.Success
+                    )
+                    return
             
-        except Exception as e:
-            self.iface.messageBar().pushMessage(
-                "Error", 
-                f"Failed to create AIXM file: {str(e)}", 
-                level=Qgis.Critical
-            )
-            return False
-
-    def _generate_aixm_file(self, layers, file_path):
-        """Generate AIXM 5.1.1 compliant XML file"""
-        import xml.etree.ElementTree as ET
-        from datetime import datetime
-        import uuid
-        
-        # Create root element with AIXM 5.1.1 namespace
-        root = ET.Element("aixm:AIXMBasicMessage")
-        root.set("xmlns:aixm", "http://www.aixm.aero/schema/5.1.1")
-        root.set("xmlns:gml", "http://www.opengis.net/gml/3.2")
-        root.set("xmlns:xlink", "http://www.w3.org/1999/xlink")
-        root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-        root.set("xsi:schemaLocation", "http://www.aixm.aero/schema/5.1.1 http://www.aixm.aero/schema/5.1.1/AIXM_BasicMessage.xsd")
-        
-        # Add message metadata
-        header = ET.SubElement(root, "gml:boundedBy")
-        ET.SubElement(header, "gml:Null").text = "unknown"
-        
-        # Add feature member for each layer
-        for layer in layers:
-            if layer.featureCount() == 0:
-                continue
-                
-            if "reference_line" in layer.name().lower():
-                self._add_aixm_reference_line(root, layer)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if canceled:
+                push_message(
+                    "Info", 
+                    "AIXM export cancelled by user", 
+                    level=Qgis.Info
+                )
+            elif exception is not None:
+                if isinstance(exception, (OSError, ValueError, QgsCsException)):
+                    logger.error("Failed to create AIXM file: %s", exception,
+                                 exc_info=logger.isEnabledFor(logging.DEBUG) and exception)
+                else:
+                    logger.error("Unexpected error while creating AIXM file %s", file_path, exc_info=exception)
+                push_message(
+                    "Error", 
+                    f"Failed to create AIXM file: {str(exception)}", 
+                    level=Qgis.Critical
+                )
             else:
-                self._add_aixm_surface(root, layer)
+                push_message(
+                    "Error", 
+                    "No features to export in any layer", 
+                    level=Qgis.Critical
+                )
         
-        # Write to file with proper formatting
-        tree = ET.ElementTree(root)
-        ET.indent(tree, space="  ", level=0)
-        tree.write(file_path, encoding='utf-8', xml_declaration=True)
+        # Write the file in a background task so the interface stays responsive;
+        # feature sources are snapshots of the layers that are safe to read from
+        # the worker thread, and each gets its own copy of the cached transform
+        sources = [
+            (layer.name(), QgsVectorLayerFeatureSource(layer),
+             QgsCoordinateTransform(self._get_wgs84_transform(layer.crs())))
+            for layer in layers
+        ]
+        task = QgsTask.fromFunction(
+            "Export AIXM",
+            self._generate_aixm_file,
+            sources,
+            part_path,
+            on_finished=export_finished
+        )
+        # Keep a reference, the task manager does not own the Python wrapper
+        self._aixm_export_tasks.add(task)
+        QgsApplication.taskManager().addTask(task)
+        return True
 
-    def _add_aixm_surface(self, root, layer):
-        """Add TOFPA surface as AIXM NavigationArea"""
-        import xml.etree.ElementTree as ET
-        import uuid
-        from datetime import datetime
-        
-        for feature in layer.getFeatures():
-            # Create feature member
-            feature_member = ET.SubElement(root, "gml:featureMember")
-            nav_area = ET.SubElement(feature_member, "aixm:NavigationArea")
-            nav_area.set("gml:id", f"tofpa_surface_{uuid.uuid4().hex[:8]}")
-            
-            # Add time slice
-            time_slice = ET.SubElement(nav_area, "aixm:timeSlice")
-            nav_area_ts = ET.SubElement(time_slice, "aixm:NavigationAreaTimeSlice")
-            nav_area_ts.set("gml:id", f"ts_{uuid.uuid4().hex[:8]}")
-            
-            # Valid time
-            valid_time = ET.SubElement(nav_area_ts, "gml:validTime")
-            time_period = ET.SubElement(valid_time, "gml:TimePeriod")
-            time_period.set("gml:id", f"tp_{uuid.uuid4().hex[:8]}")
-            begin_pos = ET.SubElement(time_period, "gml:beginPosition")
-            begin_pos.text = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-            end_pos = ET.SubElement(time_period, "gml:endPosition")
-            end_pos.set("indeterminatePosition", "unknown")
+    def _generate_aixm_file(self, task, sources, file_path):
+        """
+        Generate AIXM 5.1.1 compliant XML file.
+        
+        Runs in the export task; sources are (layer name, feature source,
+        transform to WGS84) tuples. The message is streamed: each feature member is built, written
+        and dropped in turn, so only one feature's subtree is held in memory.
+        Returns a dict with the number of features written and whether the
+        task was canceled; it is never empty, because the task wrapper only
+        passes truthy results on to the finished callback.
+        """
+        features_written = 0
+        with open(file_path, 'w', encoding='utf-8', buffering=AIXM_WRITE_BUFFER_SIZE) as out:
+            out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+            # Root element with AIXM 5.1.1 namespace
+            out.write("<aixm:AIXMBasicMessage")
+            for name, value in AIXM_MESSAGE_ATTRIBUTES:
+                out.write(f' {name}="{value}"')
+            out.write(">\n")
             
-            # Interpretation
-            interpretation = ET.SubElement(nav_area_ts, "aixm:interpretation")
-            interpretation.text = "BASELINE"
+            # Add message metadata
+            header = ET.Element("gml:boundedBy")
+            ET.SubElement(header, "gml:Null").text = "unknown"
+            self._write_aixm_element(out, header)
             
-            # Designator
-            designator = ET.SubElement(nav_area_ts, "aixm:designator")
-            designator.text = "TOFPA_AOC_TypeA"
+            # Add feature member for each layer; empty layers write nothing.
+            # Only geometries are exported, so no attributes are fetched
+            request = QgsFeatureRequest().setNoAttributes()
+            # gml:ids only need to be unique within the message, so they are
+            # numbered; all time slices begin at the export time
+            ids = (f"{n:08x}" for n in itertools.count())
+            begin_position = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            for i, (name, source, transform) in enumerate(sources):
+                if task.isCanceled():
+                    return {'features_written': features_written, 'canceled': True}
+                if "reference_line" in name.lower():
+                    features_written += self._add_aixm_reference_line(out, source, transform, request, ids)
+                else:
+                    features_written += self._add_aixm_surface(out, source, transform, request, ids, begin_position)
+                task.setProgress(100 * (i + 1) / len(sources))
             
-            # Type
-            nav_type = ET.SubElement(nav_area_ts, "aixm:type")
-            nav_type.text = "TAKEOFF_CLIMB_SURFACE"
+            out.write("</aixm:AIXMBasicMessage>\n")
+        return {'features_written': features_written, 'canceled': False}
+
+    def _write_aixm_element(self, out, element, level=1):
+        """Write an element of the AIXM message at the given indentation level"""
+        out.write(self._aixm_element_markup(element, level))
+
+    def _aixm_element_markup(self, element, level):
+        """Markup of an element of the AIXM message at the given indentation level, with its line break"""
+        ET.indent(element, space="  ", level=level)
+        return "  " * level + ET.tostring(element, encoding="unicode") + "\n"
+
+    def _add_aixm_surface(self, out, source, transform, request, ids, begin_position):
+        """Write TOFPA surface as AIXM NavigationArea, returning the number of features written"""
+        # Each feature member is collected in parts and written with a single call
+        parts = []
+        append = parts.append
+        count = 0
+        for feature in source.getFeatures(request):
+            count += 1
+            # Static markup comes from precomputed fragments; only the ids, the
+            # begin time and the geometry are produced per feature
+            parts += (
+                AIXM_NAV_AREA_OPEN,
+                next(ids),
+                AIXM_NAV_AREA_TIME_SLICE_OPEN,
+                next(ids),
+                AIXM_NAV_AREA_TIME_PERIOD_OPEN,
+                next(ids),
+                AIXM_NAV_AREA_BEGIN_OPEN,
+                begin_position,
+                AIXM_NAV_AREA_BEGIN_CLOSE,
+            )
             
             # Geometry
             geom = feature.geometry()
             if geom and not geom.isEmpty():
-                self._add_aixm_geometry(nav_area_ts, geom)
+                time_slice = ET.Element("aixm:NavigationAreaTimeSlice")
+                self._add_aixm_geometry(time_slice, geom, transform, ids)
+                for element in time_slice:
+                    append(self._aixm_element_markup(element, 5))
+            
+            append(AIXM_NAV_AREA_CLOSE)
+            out.write(''.join(parts))
+            parts.clear()
+        return count
 
-    def _add_aixm_reference_line(self, root, layer):
-        """Add reference line as AIXM Curve"""
-        import xml.etree.ElementTree as ET
-        import uuid
-        from datetime import datetime
-        
-        for feature in layer.getFeatures():
+    def _add_aixm_reference_line(self, out, source, transform, request, ids):
+        """Write reference line as AIXM Curve, returning the number of features written"""
+        count = 0
+        for feature in source.getFeatures(request):
+            count += 1
             # Create feature member
-            feature_member = ET.SubElement(root, "gml:featureMember")
+            feature_member = ET.Element("gml:featureMember")
             curve = ET.SubElement(feature_member, "aixm:Curve")
-            curve.set("gml:id", f"reference_line_{uuid.uuid4().hex[:8]}")
+            curve.set("gml:id", f"reference_line_{next(ids)}")
             
             # Add designator
             designator = ET.SubElement(curve, "aixm:designator")
@@ -1167,35 +1321,34 @@ class TOFPA:
             # Geometry
             geom = feature.geometry()
             if geom and not geom.isEmpty():
-                self._add_aixm_geometry(curve, geom)
+                self._add_aixm_geometry(curve, geom, transform, ids)
+            
+            self._write_aixm_element(out, feature_member)
+        return count
 
-    def _add_aixm_geometry(self, parent, geometry):
-        """Add geometry to AIXM element in GML format"""
-        import xml.etree.ElementTree as ET
-        
-        # Transform to WGS84 for AIXM compliance
-        crs_4326 = QgsCoordinateReferenceSystem("EPSG:4326")
-        transform = QgsCoordinateTransform(
-            geometry.crs() if hasattr(geometry, 'crs') else QgsProject.instance().crs(),
-            crs_4326,
-            QgsProject.instance()
-        )
-        
-        geom_4326 = QgsGeometry(geometry)
-        geom_4326.transform(transform)
+    def _add_aixm_geometry(self, parent, geometry, transform, ids):
+        """
+        Add geometry to AIXM element in GML format.
         
-        if geometry.type() == QgsWkbTypes.PolygonGeometry:
-            self._add_gml_surface(parent, geom_4326)
-        elif geometry.type() == QgsWkbTypes.LineGeometry:
-            self._add_gml_curve(parent, geom_4326)
+        The geometry is the writer's own copy of the feature geometry and is
+        transformed in place.
+        """
+        # Transform to WGS84 for AIXM compliance, with the layer's transform;
+        # layers already in WGS84 are used as they are
+        if not transform.isShortCircuited():
+            geometry.transform(transform)
+        
+        geometry_type = geometry.type()
+        if geometry_type == QgsWkbTypes.PolygonGeometry:
+            self._add_gml_surface(parent, geometry, ids)
+        elif geometry_type == QgsWkbTypes.LineGeometry:
+            self._add_gml_curve(parent, geometry, ids)
 
-    def _add_gml_surface(self, parent, geometry):
+    def _add_gml_surface(self, parent, geometry, ids):
         """Add GML Surface geometry"""
-        import xml.etree.ElementTree as ET
-        
         geom_elem = ET.SubElement(parent, "aixm:geometryComponent")
         surface = ET.SubElement(geom_elem, "aixm:Surface")
-        surface.set("gml:id", f"srf_{hash(str(geometry.asWkt())) & 0x7fffffff}")
+        surface.set("gml:id", f"srf_{next(ids)}")
         surface.set("srsName", "urn:ogc:def:crs:EPSG::4326")
         surface.set("srsDimension", "3")
         
@@ -1208,25 +1361,17 @@ class TOFPA:
         pos_list = ET.SubElement(linear_ring, "gml:posList")
         
         # Get coordinates
+        polygon = geometry.constGet()
         if geometry.isMultipart():
-            polygon = geometry.asMultiPolygon()[0][0]  # First polygon, exterior ring
-        else:
-            polygon = geometry.asPolygon()[0]  # Exterior ring
-            
-        coords = []
-        for point in polygon:
-            # AIXM uses lat,lon,alt order
-            coords.extend([f"{point.y():.8f}", f"{point.x():.8f}", f"{point.z():.3f}" if point.is3D() else "0.000"])
+            polygon = polygon.geometryN(0)  # First polygon
         
-        pos_list.text = " ".join(coords)
+        pos_list.text = self._gml_pos_list(polygon.exteriorRing())
 
-    def _add_gml_curve(self, parent, geometry):
+    def _add_gml_curve(self, parent, geometry, ids):
         """Add GML Curve geometry"""
-        import xml.etree.ElementTree as ET
-        
         geom_elem = ET.SubElement(parent, "aixm:geometryComponent")
         curve = ET.SubElement(geom_elem, "aixm:Curve")
-        curve.set("gml:id", f"crv_{hash(str(geometry.asWkt())) & 0x7fffffff}")
+        curve.set("gml:id", f"crv_{next(ids)}")
         curve.set("srsName", "urn:ogc:def:crs:EPSG::4326")
         curve.set("srsDimension", "3")
         
@@ -1235,14 +1380,13 @@ class TOFPA:
         pos_list = ET.SubElement(line_segment, "gml:posList")
         
         # Get coordinates
+        line = geometry.constGet()
         if geometry.isMultipart():
-            line = geometry.asMultiPolyline()[0]  # First line
-        else:
-            line = geometry.asPolyline()
-            
-        coords = []
-        for point in line:
-            # AIXM uses lat,lon,alt order
-            coords.extend([f"{point.y():.8f}", f"{point.x():.8f}", f"{point.z():.3f}" if point.is3D() else "0.000"])
+            line = line.geometryN(0)  # First line
         
-        pos_list.text = " ".join(coords)
+        pos_list.text = self._gml_pos_list(line)
+
+    def _gml_pos_list(self, line):
+        """GML posList of a QgsLineString, read as coordinate arrays (AIXM uses lat,lon,alt order)"""
+        alts = line.zVector() if line.is3D() else np.zeros(line.numPoints())
+        return gml_pos_list(line.yVector(), line.xVector(), alts)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FLYGHT7 -  TOFPA
+                                 A QGIS plugin
+ Takeoff and Final Approach Analysis Tool
+
+ Numeric kernels for the obstacles analysis. These work on plain NumPy
+ arrays so they can run over a whole obstacle layer in a single pass.
+
+ /***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Numba is optional: without it the NumPy versions of the kernels are used
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# The Cython shadow kernel is only available once _shadow.pyx has been built
+try:
+    from ._shadow import shadow_pairs as _compiled_shadow_pairs
+except ImportError:
+    _compiled_shadow_pairs = None
+
+# WKB type codes (ISO) for the geometries built from the arrays
+WKB_POLYGON = 3
+WKB_POINT_Z = 1001
+
+# Extra width (degrees) of the bearing window used to prefilter shadow candidates
+WINDOW_MARGIN_DEG = 1e-6
+
+# Points per worker chunk in the threaded point-in-polygon test
+POINTS_CHUNK_SIZE = 8192
+
+# Decimals of the lat, lon and alt values in a GML posList
+POS_LIST_DECIMALS = (8, 8, 3)
+# Upper bound of the characters written per formatted value (sign, 19 integer
+# digits, point, decimals and separator)
+FIXED_VALUE_MAX_WIDTH = 32
+
+# One packed record per analyzed obstacle
+OBSTACLE_DTYPE = np.dtype([
+    ('id', np.int64),        # Source feature id
+    ('x', np.float64),
+    ('y', np.float64),
+    ('height', np.float64),
+    ('is_critical', np.bool_),
+])
+
+
+def points_in_rings(xs, ys, rings):
+    """
+    Vectorized even-odd point-in-polygon test.
+
+    xs, ys are 1-D coordinate arrays and rings is a list of closed (M, 2)
+    vertex arrays (exterior and interior rings of every polygon part).
+    Returns a boolean array that is True where the point lies inside.
+    """
+    px = np.asarray(xs, dtype=np.float64)[:, None]
+    py = np.asarray(ys, dtype=np.float64)[:, None]
+    crossings = np.zeros(px.shape[0], dtype=np.int64)
+
+    for ring in rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        # Edges straddling the horizontal ray through each point
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        crossings += np.count_nonzero(straddles & (px < x_cross), axis=1)
+
+    return crossings % 2 == 1
+
+
+def points_in_rings_threaded(xs, ys, rings, chunk_size=POINTS_CHUNK_SIZE):
+    """
+    points_in_rings over chunks of points on a thread pool.
+
+    NumPy releases the GIL inside the ring comparisons, so chunks run in
+    parallel; chunking also bounds the (points, vertices) temporaries.
+    Small inputs are tested directly.
+    """
+    n = len(xs)
+    if n <= chunk_size:
+        return points_in_rings(xs, ys, rings)
+
+    def test_chunk(start):
+        return points_in_rings(xs[start:start + chunk_size], ys[start:start + chunk_size], rings)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return np.concatenate(list(executor.map(test_chunk, range(0, n, chunk_size))))
+
+
+def circle_template(radius, segments=16):
+    """
+    Closed ring approximating a circle of the given radius around the origin.
+
+    Uses the same vertex count as QgsGeometry.buffer(radius, segments)
+    (segments per quarter circle) and returns the (dx, dy) offset arrays,
+    ready to be translated onto each obstacle.
+    """
+    theta = np.linspace(0.0, 2.0 * np.pi, 4 * segments + 1)
+    dx = np.cos(theta) * radius
+    dy = np.sin(theta) * radius
+    # Close the ring exactly
+    dx[-1] = dx[0]
+    dy[-1] = dy[0]
+    return dx, dy
+
+
+def point_z_wkb(x, y, z):
+    """Little-endian WKB of a Point Z, for QgsGeometry.fromWkb"""
+    return struct.pack('<BIddd', 1, WKB_POINT_Z, x, y, z)
+
+
+def polygon_wkb(ring_x, ring_y):
+    """Little-endian WKB of a single-ring Polygon from closed coordinate arrays"""
+    coords = np.empty((ring_x.shape[0], 2), dtype='<f8')
+    coords[:, 0] = ring_x
+    coords[:, 1] = ring_y
+    return struct.pack('<BIII', 1, WKB_POLYGON, 1, coords.shape[0]) + coords.tobytes()
+
+
+def project_points(x0, y0, azimuth, distances, offsets):
+    """
+    Planar projection of points from (x0, y0) along an azimuth (degrees).
+
+    Each point lies distances[k] ahead in the azimuth direction and
+    offsets[k] to the side of azimuth + 90, the same as chaining
+    QgsPoint.project(distance, azimuth) and project(offset, azimuth + 90).
+    Returns the (xs, ys) coordinate arrays.
+    """
+    return _project_points(float(x0), float(y0), math.radians(azimuth),
+                           np.asarray(distances, dtype=np.float64),
+                           np.asarray(offsets, dtype=np.float64))
+
+
+def _project_points(x0, y0, azimuth_rad, distances, offsets):
+    """Kernel of project_points on float64 arrays, with the azimuth in radians"""
+    sin_az = math.sin(azimuth_rad)
+    cos_az = math.cos(azimuth_rad)
+    xs = x0 + distances * sin_az + offsets * cos_az
+    ys = y0 + distances * cos_az - offsets * sin_az
+    return xs, ys
+
+
+def gml_pos_list(lats, lons, alts):
+    """
+    GML posList text of 3D positions in lat, lon, alt order.
+
+    Coordinates are formatted with 8 decimals (lat, lon) and 3 (alt) in a
+    single %-format call over the interleaved array instead of one
+    f-string per value.
+    """
+    coords = np.empty((len(lats), 3), dtype=np.float64)
+    coords[:, 0] = lats
+    coords[:, 1] = lons
+    coords[:, 2] = alts
+    if njit is None:
+        return ' '.join(('%.8f %.8f %.3f',) * coords.shape[0]) % tuple(coords.ravel().tolist())
+
+    # Compiled formatter writing the ASCII digits straight into a byte buffer
+    decimals = np.tile(np.array(POS_LIST_DECIMALS, dtype=np.int64), coords.shape[0])
+    out = np.empty(coords.size * FIXED_VALUE_MAX_WIDTH, dtype=np.uint8)
+    length = _format_fixed(coords.ravel(), decimals, out)
+    return out[:length].tobytes().decode('ascii')
+
+
+def _format_fixed(values, decimals, out):
+    """
+    Write values as space separated fixed-point decimals into the out buffer.
+
+    values[k] gets decimals[k] digits after the point, rounded half up on
+    the scaled value; like '%.*f' the sign is kept on values that round to
+    zero. Returns the number of bytes written.
+    """
+    digits = np.empty(20, dtype=np.uint8)
+    pos = 0
+    for k in range(values.shape[0]):
+        if k > 0:
+            out[pos] = 32  # ' '
+            pos += 1
+        value = values[k]
+        scale = 10 ** decimals[k]
+        if value < 0.0 or (value == 0.0 and math.copysign(1.0, value) < 0.0):
+            out[pos] = 45  # '-'
+            pos += 1
+        scaled = np.int64(math.floor(abs(value) * scale + 0.5))
+        integer = scaled // scale
+        fraction = scaled % scale
+
+        # Integer part, most significant digit first
+        count = 0
+        while True:
+            digits[count] = 48 + integer % 10
+            integer //= 10
+            count += 1
+            if integer == 0:
+                break
+        for m in range(count - 1, -1, -1):
+            out[pos] = digits[m]
+            pos += 1
+
+        # Fraction, zero padded to the requested decimals
+        if decimals[k] > 0:
+            out[pos] = 46  # '.'
+            pos += 1
+            for m in range(decimals[k] - 1, -1, -1):
+                out[pos + m] = 48 + fraction % 10
+                fraction //= 10
+            pos += decimals[k]
+    return pos
+
+
+def _sorted_bearing_window(xs, ys, tx, ty):
+    """
+    Sort obstacles by bearing from the takeoff point for the windowed sweep.
+
+    Returns the sorted bearings (degrees) and two arrays covering three
+    turns (bearing - 360, bearing, bearing + 360) with the matching
+    obstacle indices, so a window that crosses north is still contiguous.
+    """
+    bearing = np.degrees(np.arctan2(xs - tx, ys - ty))
+    order = np.argsort(bearing)
+    sorted_bearing = bearing[order]
+    bearing_turns = np.concatenate((sorted_bearing - 360.0, sorted_bearing, sorted_bearing + 360.0))
+    index_turns = np.concatenate((order, order, order))
+    return order, sorted_bearing, bearing_turns, index_turns
+
+
+def _shadow_pairs(xs, ys, hs, tx, ty, tz, tol_deg):
+    """
+    Pairwise shadow test of obstacles seen from the takeoff point (tx, ty, tz).
+
+    Obstacle i is shadowed by obstacle j when j is closer to the takeoff
+    point, higher, within tol_deg of bearing and subtends a higher
+    elevation angle. Returns, for each obstacle, the index of the first
+    shadowing obstacle or -1 when it is visible.
+
+    Obstacles are sorted by bearing so each target only examines the
+    candidates inside its +/- tol_deg window instead of every obstacle.
+    """
+    n = xs.shape[0]
+    shadowed_by = np.full(n, -1, dtype=np.int64)
+    # Two bearings are within tol_deg when their unit vectors have a dot
+    # product of at least cos(tol_deg); this avoids atan2 and the 360
+    # degree wraparound in the pair loop
+    cos_tol = math.cos(math.radians(tol_deg))
+
+    distance = np.empty(n, dtype=np.float64)
+    ux = np.zeros(n, dtype=np.float64)
+    uy = np.zeros(n, dtype=np.float64)
+    for k in range(n):
+        dx = xs[k] - tx
+        dy = ys[k] - ty
+        distance[k] = math.hypot(dx, dy)
+        if distance[k] > 0.0:
+            ux[k] = dx / distance[k]
+            uy[k] = dy / distance[k]
+
+    order, sorted_bearing, bearing_turns, index_turns = _sorted_bearing_window(xs, ys, tx, ty)
+    # The window is only a prefilter; the exact cone test is the dot product
+    margin = tol_deg + WINDOW_MARGIN_DEG
+
+    for k in range(n):
+        i = order[k]
+        lo = np.searchsorted(bearing_turns, sorted_bearing[k] - margin)
+        hi = np.searchsorted(bearing_turns, sorted_bearing[k] + margin, side='right')
+        first = n
+        for m in range(lo, hi):
+            j = index_turns[m]
+            # Shadowing obstacle must be closer (never true for j == i) and higher
+            if j >= first or distance[j] >= distance[i] or hs[j] <= hs[i] or distance[j] <= 0.0:
+                continue
+            # Within the angular tolerance (shadow cone)
+            if ux[i] * ux[j] + uy[i] * uy[j] < cos_tol:
+                continue
+            # Shadowing obstacle must have the higher elevation angle. atan is
+            # monotonic and both distances are positive, so compare
+            # dh_j / d_j > dh_i / d_i cross-multiplied instead
+            if (hs[j] - tz) * distance[i] > (hs[i] - tz) * distance[j]:
+                first = j
+        if first < n:
+            shadowed_by[i] = first
+    return shadowed_by
+
+
+def _shadow_pairs_vectorized(xs, ys, hs, tx, ty, tz, tol_deg, block_size=256):
+    """
+    NumPy broadcasting version of _shadow_pairs for when Numba is not available.
+
+    Targets are taken in blocks of consecutive bearings and only compared
+    with the obstacles inside the block's bearing window, which keeps the
+    pair masks small on large obstacle sets.
+    """
+    n = xs.shape[0]
+    shadowed_by = np.full(n, -1, dtype=np.int64)
+    cos_tol = math.cos(math.radians(tol_deg))
+    dx = xs - tx
+    dy = ys - ty
+    distance = np.hypot(dx, dy)
+    can_shadow = distance > 0.0
+    ux = np.divide(dx, distance, out=np.zeros(n), where=can_shadow)
+    uy = np.divide(dy, distance, out=np.zeros(n), where=can_shadow)
+    dh = hs - tz
+
+    order, sorted_bearing, bearing_turns, index_turns = _sorted_bearing_window(xs, ys, tx, ty)
+    margin = tol_deg + WINDOW_MARGIN_DEG
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        rows = order[start:stop]
+        lo = np.searchsorted(bearing_turns, sorted_bearing[start] - margin)
+        hi = np.searchsorted(bearing_turns, sorted_bearing[stop - 1] + margin, side='right')
+        cols = index_turns[lo:hi]
+
+        alignment = ux[rows, None] * ux[None, cols] + uy[rows, None] * uy[None, cols]
+        mask = ((distance[None, cols] < distance[rows, None])
+                & (hs[None, cols] > hs[rows, None])
+                & (alignment >= cos_tol)
+                & (dh[None, cols] * distance[rows, None] > dh[rows, None] * distance[None, cols])
+                & can_shadow[None, cols])
+        # Keep the lowest obstacle index, as the unsorted loop would find first
+        first = np.where(mask, cols[None, :], n).min(axis=1, initial=n)
+        hit = first < n
+        shadowed_by[rows[hit]] = first[hit]
+    return shadowed_by
+
+
+if njit is not None:
+    _project_points = njit(cache=True)(_project_points)
+    _format_fixed = njit(cache=True)(_format_fixed)
+
+if _compiled_shadow_pairs is not None:
+    shadow_pairs = _compiled_shadow_pairs
+elif njit is not None:
+    # Compiled kernels can only call other compiled functions
+    _sorted_bearing_window = njit(cache=True)(_sorted_bearing_window)
+    shadow_pairs = njit(cache=True)(_shadow_pairs)
+else:
+    shadow_pairs = _shadow_pairs_vectorized
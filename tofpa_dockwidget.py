@@ -4,12 +4,36 @@ FLYGHT7
 import os
 
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import pyqtSignal, Qt, QVariant
+from qgis.PyQt.QtCore import pyqtSignal, pyqtSlot, QSignalBlocker, QTimer, Qt, QVariant
 from qgis.PyQt.QtWidgets import QDockWidget
-from qgis.core import QgsMapLayerProxyModel, QgsWkbTypes
+from qgis.core import QgsMapLayerProxyModel, QgsProject, QgsVectorLayer, QgsWkbTypes
 
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
-    os.path.dirname(__file__), 'tofpa_panel_base.ui'))
+# Optional precompiled form, built in the plugin directory with
+# `pyuic5 tofpa_panel_base.ui -o ui_tofpa_panel_base.py`; it is used only while
+# it is newer than the .ui file, otherwise the form is generated at import
+UI_FILE = os.path.join(os.path.dirname(__file__), 'tofpa_panel_base.ui')
+try:
+    from .ui_tofpa_panel_base import Ui_TOFPADockWidgetBase as FORM_CLASS
+    from . import ui_tofpa_panel_base
+    if os.path.getmtime(ui_tofpa_panel_base.__file__) < os.path.getmtime(UI_FILE):
+        FORM_CLASS = None
+except ImportError:
+    FORM_CLASS = None
+if FORM_CLASS is None:
+    FORM_CLASS, _ = uic.loadUiType(UI_FILE)
+
+# Whether a layer of each geometry type is excluded from the runway (lines
+# only), threshold (points only) and obstacles (points or polygons) combos;
+# any other type is excluded from all three
+GEOMETRY_EXCLUSIONS = {
+    QgsWkbTypes.LineGeometry: (False, True, True),
+    QgsWkbTypes.PointGeometry: (True, False, False),
+    QgsWkbTypes.PolygonGeometry: (True, True, False)
+}
+EXCLUDED_FROM_ALL = (True, True, True)
+
+# Field types offered for the obstacle height
+NUMERIC_FIELD_TYPES = (QVariant.Int, QVariant.Double)
 
 
 class TofpaDockWidget(QDockWidget, FORM_CLASS):
@@ -21,6 +45,7 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         """Constructor."""
         super(TofpaDockWidget, self).__init__(parent)
         self.iface = iface
+        self._project = QgsProject.instance()
         self.setupUi(self)
         
         # Configure layer combo boxes with specific geometry filters
@@ -36,16 +61,28 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         self.obstaclesLayerCombo.setFilters(QgsMapLayerProxyModel.VectorLayer)
         self.obstaclesLayerCombo.setExceptedLayerList([])
         
-        # Apply geometry-specific filters
-        self._apply_geometry_filters()
+        # Ids of the layers each combo excludes, kept up to date as layers are
+        # added and removed, and the sets last applied to the combos
+        self._excepted_layer_ids = {
+            'runway': set(),
+            'threshold': set(),
+            'obstacles': set()
+        }
+        self._applied_excepted_layer_ids = {}
         
-        # Connect to layer changes to refresh filters and obstacle field combo
-        try:
-            from qgis.core import QgsProject
-            QgsProject.instance().layersAdded.connect(self._on_layers_changed)
-            QgsProject.instance().layersRemoved.connect(self._on_layers_changed)
-        except Exception:
-            pass  # Fallback if QGIS not available
+        # Layer changes are collected and applied once per event loop pass, so
+        # a burst of additions and removals refreshes the combos only once
+        self._added_layer_ids = set()
+        # Set when a refresh was put off because the panel was hidden
+        self._filters_dirty = False
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(0)
+        self._refresh_timer.timeout.connect(self._refresh_layer_filters)
+        
+        # Apply geometry-specific filters and follow layer changes
+        self._project_connected = False
+        self._connect_project()
         
         # Connect obstacles layer change to update height field combo
         self.obstaclesLayerCombo.layerChanged.connect(self._update_obstacle_fields)
@@ -53,25 +90,8 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         # Connect checkbox to enable/disable obstacles group
         self.includeObstaclesCheckBox.toggled.connect(self._toggle_obstacles_group)
         
-        # Set default values from original script
-        self.initialWidthSpin.setValue(180.0)
-        self.maxWidthSpin.setValue(1800.0)
-        self.clearwayLengthSpin.setValue(0.0)
-        self.initialElevationSpin.setValue(0.0)
-        self.endElevationSpin.setValue(0.0)
-        self.exportToKmzCheckBox.setChecked(False)
-        self.exportToAixmCheckBox.setChecked(False)
-        self.useSelectedFeatureCheckBox.setChecked(True)
-        self.directionCombo.setCurrentIndex(0)  # Default to "Start to End (0)"
-        
-        # Set default values for obstacles
-        self.includeObstaclesCheckBox.setChecked(False)
-        self.obstacleBufferSpin.setValue(10.0)
-        self.minObstacleHeightSpin.setValue(5.0)
-        
-        # Set default values for shadow analysis
-        self.enableShadowAnalysisCheckBox.setChecked(False)
-        self.shadowToleranceSpin.setValue(5.0)
+        # Default values (from original script, obstacles and shadow analysis)
+        # are set in tofpa_panel_base.ui and applied by setupUi
         
         # Connect shadow analysis checkbox to enable/disable shadow tolerance control
         self.enableShadowAnalysisCheckBox.toggled.connect(self._toggle_shadow_controls)
@@ -84,77 +104,124 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         self.calculateButton.clicked.connect(self.on_calculate_clicked)
         self.cancelButton.clicked.connect(self.on_close_clicked)
 
-    def _apply_geometry_filters(self):
-        """Apply geometry-specific filters to layer combo boxes"""
-        from qgis.core import QgsProject
+    def _apply_geometry_filters(self, layers=None):
+        """
+        Apply geometry-specific filters to layer combo boxes.
         
-        # Get all vector layers
-        all_layers = QgsProject.instance().mapLayers().values()
-        vector_layers = [layer for layer in all_layers if hasattr(layer, 'geometryType')]
+        Only the given layers are classified (all project layers when None),
+        so a layer change costs work for the changed layers only.
+        """
+        if layers is None:
+            layers = self._project.mapLayers().values()
         
-        # Lists to store layers that don't match geometry requirements
-        non_line_layers = []
-        non_point_layers = []
-        non_obstacle_layers = []  # For obstacles: points or polygons only
+        # Sets of layers that don't match geometry requirements
+        non_line_ids = self._excepted_layer_ids['runway']
+        non_point_ids = self._excepted_layer_ids['threshold']
+        non_obstacle_ids = self._excepted_layer_ids['obstacles']  # For obstacles: points or polygons only
         
-        for layer in vector_layers:
+        for layer in layers:
+            # Only vector layers have a geometry type
+            if not isinstance(layer, QgsVectorLayer):
+                continue
             try:
-                geom_type = layer.geometryType()
-                
-                # For runway combo: exclude non-line layers
-                if geom_type != QgsWkbTypes.LineGeometry:
-                    non_line_layers.append(layer)
-                
-                # For threshold combo: exclude non-point layers  
-                if geom_type != QgsWkbTypes.PointGeometry:
-                    non_point_layers.append(layer)
-                
-                # For obstacles combo: exclude non-point and non-polygon layers
-                if geom_type not in [QgsWkbTypes.PointGeometry, QgsWkbTypes.PolygonGeometry]:
-                    non_obstacle_layers.append(layer)
-                    
-            except Exception as e:
+                non_line, non_point, non_obstacle = GEOMETRY_EXCLUSIONS.get(layer.geometryType(), EXCLUDED_FROM_ALL)
+            except Exception:
                 # If we can't determine geometry type, exclude from all
-                non_line_layers.append(layer)
-                non_point_layers.append(layer)
-                non_obstacle_layers.append(layer)
+                non_line, non_point, non_obstacle = EXCLUDED_FROM_ALL
+            
+            layer_id = layer.id()
+            if non_line:
+                non_line_ids.add(layer_id)
+            if non_point:
+                non_point_ids.add(layer_id)
+            if non_obstacle:
+                non_obstacle_ids.add(layer_id)
         
-        # Apply filters
-        self.runwayLayerCombo.setExceptedLayerList(non_line_layers)
-        self.thresholdLayerCombo.setExceptedLayerList(non_point_layers)
-        self.obstaclesLayerCombo.setExceptedLayerList(non_obstacle_layers)
+        self._set_excepted_layers()
+
+    def _set_excepted_layers(self):
+        """Apply the excluded layer sets to the combos whose set changed since it was last applied"""
+        project = self._project
+        combos = {
+            'runway': self.runwayLayerCombo,
+            'threshold': self.thresholdLayerCombo,
+            'obstacles': self.obstaclesLayerCombo
+        }
+        for key, combo in combos.items():
+            layer_ids = frozenset(self._excepted_layer_ids[key])
+            if layer_ids == self._applied_excepted_layer_ids.get(key):
+                # Setting the list resets the combo's proxy model, skip it when unchanged
+                continue
+            layers = [project.mapLayer(layer_id) for layer_id in layer_ids]
+            combo.setExceptedLayerList([layer for layer in layers if layer is not None])
+            self._applied_excepted_layer_ids[key] = layer_ids
 
-    def _on_layers_changed(self):
-        """Refresh geometry filters when layers are added or removed"""
+    def _on_layers_added(self, layers):
+        """Queue the added layers for classification by the geometry filters"""
+        self._added_layer_ids.update(layer.id() for layer in layers)
+        self._refresh_timer.start()
+
+    def _on_layers_removed(self, layer_ids):
+        """Drop the removed layers from the geometry filters"""
+        self._added_layer_ids.difference_update(layer_ids)
+        for excepted_ids in self._excepted_layer_ids.values():
+            excepted_ids.difference_update(layer_ids)
+        self._refresh_timer.start()
+
+    @pyqtSlot()
+    def _refresh_layer_filters(self):
+        """Apply the layer changes collected since the last refresh"""
+        # Nobody sees the combos of a hidden panel; catch up when it is shown
+        if not self.isVisible():
+            self._filters_dirty = True
+            return
+        self._filters_dirty = False
         try:
-            self._apply_geometry_filters()
+            project = self._project
+            layers = [project.mapLayer(layer_id) for layer_id in self._added_layer_ids]
+            self._added_layer_ids.clear()
+            self._apply_geometry_filters([layer for layer in layers if layer is not None])
             # Also update obstacle fields if obstacles layer is selected
             self._update_obstacle_fields()
         except Exception:
             pass  # Fallback if filtering fails
 
+    @pyqtSlot()
     def _update_obstacle_fields(self):
         """Update the obstacle height field combo box based on selected layer"""
         try:
-            self.obstacleHeightFieldCombo.clear()
-            
+            # Collect the numeric fields and their combo index by lowercase
+            # name in a single pass over the fields
+            numeric_names = []
+            index_by_name = {}
             layer = self.obstaclesLayerCombo.currentLayer()
             if layer:
-                # Add numeric fields to the combo
                 for field in layer.fields():
-                    if field.type() in [QVariant.Int, QVariant.Double]:
-                        self.obstacleHeightFieldCombo.addItem(field.name())
-                        
-                # Set default common field names if available
-                field_names = [field.name().lower() for field in layer.fields()]
-                for default_name in ['height', 'elevation', 'elev', 'z', 'alt', 'altitude']:
-                    if default_name in field_names:
-                        index = field_names.index(default_name)
-                        self.obstacleHeightFieldCombo.setCurrentIndex(index)
-                        break
+                    if field.type() in NUMERIC_FIELD_TYPES:
+                        name = field.name()
+                        index_by_name.setdefault(name.lower(), len(numeric_names))
+                        numeric_names.append(name)
+            
+            # Set default common field names if available
+            current_index = 0 if numeric_names else -1
+            for default_name in ['height', 'elevation', 'elev', 'z', 'alt', 'altitude']:
+                if default_name in index_by_name:
+                    current_index = index_by_name[default_name]
+                    break
+            
+            # Repopulate without emitting a change signal for every intermediate state
+            combo = self.obstacleHeightFieldCombo
+            blocker = QSignalBlocker(combo)
+            try:
+                combo.clear()
+                combo.addItems(numeric_names)
+                combo.setCurrentIndex(current_index)
+            finally:
+                blocker.unblock()
         except Exception:
             pass  # Fallback if field update fails
 
+    @pyqtSlot(bool)
     def _toggle_obstacles_group(self, enabled):
         """Enable or disable the obstacles group based on checkbox state"""
         try:
@@ -170,6 +237,7 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         except Exception:
             pass  # Fallback if toggle fails
 
+    @pyqtSlot(bool)
     def _toggle_shadow_controls(self, enabled):
         """Enable or disable shadow analysis controls based on checkbox state"""
         try:
@@ -189,10 +257,12 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         except Exception:
             pass  # Fallback if toggle fails
 
+    @pyqtSlot()
     def on_calculate_clicked(self):
         """Emit signal when calculate button is clicked"""
         self.calculateClicked.emit()
     
+    @pyqtSlot()
     def on_close_clicked(self):
         """Emit signal when close button is clicked"""
         self.closeClicked.emit()
@@ -202,6 +272,12 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
         # Get direction value: index 0 = 0 (start to end), index 1 = -1 (end to start)
         direction_value = 0 if self.directionCombo.currentIndex() == 0 else -1
         
+        # Read each combo and checkbox once
+        runway_layer = self.runwayLayerCombo.currentLayer()
+        threshold_layer = self.thresholdLayerCombo.currentLayer()
+        obstacles_layer = self.obstaclesLayerCombo.currentLayer()
+        include_obstacles = self.includeObstaclesCheckBox.isChecked()
+        
         return {
             'width_tofpa': self.initialWidthSpin.value(),
             'max_width_tofpa': self.maxWidthSpin.value(),
@@ -209,22 +285,57 @@ class TofpaDockWidget(QDockWidget, FORM_CLASS):
             'z0': self.initialElevationSpin.value(),
             'ze': self.endElevationSpin.value(),
             's': direction_value,
-            'runway_layer_id': self.runwayLayerCombo.currentLayer().id() if self.runwayLayerCombo.currentLayer() else None,
-            'threshold_layer_id': self.thresholdLayerCombo.currentLayer().id() if self.thresholdLayerCombo.currentLayer() else None,
+            'runway_layer_id': runway_layer.id() if runway_layer else None,
+            'threshold_layer_id': threshold_layer.id() if threshold_layer else None,
             'use_selected_feature': self.useSelectedFeatureCheckBox.isChecked(),
             'export_kmz': self.exportToKmzCheckBox.isChecked(),
             'export_aixm': self.exportToAixmCheckBox.isChecked(),
             # New obstacles parameters
-            'include_obstacles': self.includeObstaclesCheckBox.isChecked(),
-            'obstacles_layer_id': self.obstaclesLayerCombo.currentLayer().id() if self.obstaclesLayerCombo.currentLayer() and self.includeObstaclesCheckBox.isChecked() else None,
-            'obstacle_height_field': self.obstacleHeightFieldCombo.currentText() if self.includeObstaclesCheckBox.isChecked() else None,
+            'include_obstacles': include_obstacles,
+            'obstacles_layer_id': obstacles_layer.id() if obstacles_layer and include_obstacles else None,
+            'obstacle_height_field': self.obstacleHeightFieldCombo.currentText() if include_obstacles else None,
             'obstacle_buffer': self.obstacleBufferSpin.value(),
             'min_obstacle_height': self.minObstacleHeightSpin.value(),
             # New shadow analysis parameters
-            'enable_shadow_analysis': self.enableShadowAnalysisCheckBox.isChecked() and self.includeObstaclesCheckBox.isChecked(),
+            'enable_shadow_analysis': self.enableShadowAnalysisCheckBox.isChecked() and include_obstacles,
             'shadow_tolerance': self.shadowToleranceSpin.value()
         }
 
+    def _connect_project(self):
+        """Classify all project layers and follow later layer changes to refresh filters and obstacle field combo"""
+        for excepted_ids in self._excepted_layer_ids.values():
+            excepted_ids.clear()
+        self._apply_geometry_filters()
+        try:
+            self._project.layersAdded.connect(self._on_layers_added)
+            self._project.layersRemoved.connect(self._on_layers_removed)
+            self._project_connected = True
+        except Exception:
+            pass  # Fallback if QGIS not available
+
+    def _disconnect_project(self):
+        """Stop following project layer changes while the panel is closed"""
+        if not self._project_connected:
+            return
+        self._refresh_timer.stop()
+        self._added_layer_ids.clear()
+        try:
+            self._project.layersAdded.disconnect(self._on_layers_added)
+            self._project.layersRemoved.disconnect(self._on_layers_removed)
+        except TypeError:
+            pass  # Already disconnected
+        self._project_connected = False
+
+    def showEvent(self, event):
+        # A closed panel missed the layer changes made meanwhile, so start over
+        if not self._project_connected:
+            self._connect_project()
+            self._update_obstacle_fields()
+        elif self._filters_dirty:
+            self._refresh_timer.start()
+        super(TofpaDockWidget, self).showEvent(event)
+
     def closeEvent(self, event):
+        self._disconnect_project()
         self.closingPlugin.emit()
         event.accept()